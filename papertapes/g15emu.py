@@ -0,0 +1,934 @@
+#!/usr/bin/env python3
+
+# Bendix G-15 instruction-level emulator
+
+# Executes assembled blocks against a word-level model of the drum:
+# long lines 0-19 (108 words), short lines 20-23 (4 words), the two-word
+# registers MQ, ID and PN, the accumulator AR and the command line
+# selected by CD. The machine is driven by "g15util.py run".
+#
+# Timing follows the read command (RC) / transfer (TR) sequencing of
+# hdl/hardware/control_gate.sv. Every command costs exactly the word times
+# the hardware spends reading it, waiting for T, transferring and waiting
+# for N, so the elapsed word time count matches the bit-serial design.
+
+import sys
+import struct
+import mmap
+from array import array
+
+from g15util import (decode_word, add_29, word29_to_str, bin_to_dstr,
+                     block_to_quads, quads_to_block, cl_name, sc_name,
+                     command_to_pprasm, command_to_semantics, pt_codes, pt_decode,
+                     pt_encode)
+
+# Word times per drum revolution
+WORDS = 108
+# Bit time of the HDL clock (9.3 us) times 29 bits per word
+WORD_TIME_US = 29 * 9.3
+
+MASK28 = 0x0fffffff
+MASK29 = 0x1fffffff
+MASK57 = (1 << 57) - 1
+MASK58 = (1 << 58) - 1
+
+# Drum line selected by the CD register (see cl_name)
+cl_line = [0, 1, 2, 3, 4, 5, 19, 23]
+# Lines commands can be read from. Writes to them invalidate translations.
+cmd_lines = frozenset(cl_line)
+
+# I/O device speeds in characters per second. The photo reader matches
+# the 5 ms/character of hdl/sim/tape_reader.sv.
+READ_CPS = 200
+TYPE_CPS = 10
+PUNCH_CPS = 17
+FAST_PUNCH_CPS = 60
+
+def chars_to_word_times(chars, cps):
+    # Word times an I/O device needs to move the given number of characters
+    return int(chars * 1e6 / (cps * WORD_TIME_US)) + 1
+
+# Snapshot file: SNAP_HEADER, the 32 special command counts (SNAP_COUNTS)
+# and then every word of m, line by line, as little-endian 32-bit words.
+# The tape position is the photo reader's character offset, followed by the
+# characters it has moved.
+SNAP_MAGIC = b"G15S"
+SNAP_VERSION = 1
+SNAP_HEADER = struct.Struct("<4sHHIIIIIIQQQQ")
+SNAP_COUNTS = struct.Struct("<32Q")
+SNAP_WORDS = 20 * WORDS + 4 * 4 + 3 * 2
+
+def rot_sign(word):
+    # Move the sign from bit 0 to bit 28 so that the G-15's end-around
+    # sign arithmetic becomes plain 29-bit binary arithmetic (see add_29)
+    return ((word & 0x1) << 28) | (word >> 1)
+
+def unrot_sign(word):
+    return ((word << 1) | (word >> 28)) & MASK29
+
+def multiply_steps(mq, id, pn, steps):
+    # Multiply one step at a time: add ID to PN when the top bit of MQ is
+    # set, then shift ID right and MQ left. Returns [mq, id, pn].
+    for i in range(steps):
+        if ((mq >> 56) & 0x1):
+            pn = (pn + id) & MASK57
+        id >>= 1
+        mq = (mq << 1) & MASK57
+    return [mq, id, pn]
+
+def divide_steps(mq, id, pn, steps):
+    # Restoring division one step at a time: subtract ID from PN when it
+    # fits, shift PN left and the quotient bit into MQ. Returns [mq, pn].
+    for i in range(steps):
+        q = 1 if (pn >= id) else 0
+        if (q):
+            pn -= id
+        pn = (pn << 1) & MASK58
+        mq = ((mq << 1) | q) & MASK57
+    return [mq, pn]
+
+# -----------------------------------------------------------------------------
+# G-15 machine state
+# -----------------------------------------------------------------------------
+class G15:
+    def __init__(self):
+        # Lines 0-19 hold 108 words, 20-23 hold 4 words and the two-word
+        # registers MQ (24), ID (25) and PN (26) hold 2 words. A word of a
+        # short line is selected by the drum word time modulo its length.
+        # Lines are always updated in place: translations hold references
+        # to them.
+        self.m = ([[0] * WORDS for i in range(20)] +
+                  [[0] * 4 for i in range(4)] +
+                  [[0] * 2 for i in range(3)])
+        self.ar = 0
+        # IP holds the sign of the MQ, ID and PN registers
+        self.ip = 0
+        # FO is the overflow flip-flop
+        self.fo = 0
+        # Elapsed word times. The drum word under the heads is wt % 108.
+        self.wt = 0
+        # Next command: command line (index into cl_line) and word address
+        self.cd = 0
+        self.n = 0
+        # Word address of the command being executed
+        self.l = 0
+        # CQ: read next command at N+1, CG: next command from AR
+        self.cq = False
+        self.cg = False
+        # Word time recorded by Mark_Exit for Return_Exit
+        self.mark = 0
+        # Complement control for the transfer in progress (IS and IC)
+        self.is_ = 0
+        self.ic = 0
+        self.bp_switch = False
+        self.halted = False
+        self.stop_reason = ""
+        # run() stops once wt reaches this word time
+        self.limit = 0
+        self.commands = 0
+        self.specials = 32 * [0]
+        # Photo tape reader, with no tape mounted
+        self.reader = PhotoReader()
+        # Typewriter and punch output
+        self.output = OutputSink()
+        # The I/O section is READY again at this word time
+        self.io_ready_wt = 0
+        # Translation cache: (line, word address) -> (command word, closure)
+        self.tcache = {}
+        # Profile, when enabled by setting it to {}: (line, word address) ->
+        # [commands, word times, drum wait, command word] (see step_profiled)
+        self.profile = None
+        # [loops, word times per loop] jumped over by skip_ready_loop in
+        # the last step
+        self.skipped = [0, 0]
+
+    def load(self, line, block, origin=0):
+        # Words are stored as write() stores them: the 4 words of lines
+        # 20-23 repeat every fourth word address
+        for i in range(len(block)):
+            self.write(line, (origin + i) % WORDS, block[i] & MASK29)
+
+    def mount_tape(self, reader):
+        self.reader = reader
+
+    def stop(self, reason):
+        self.halted = True
+        self.stop_reason = reason
+
+    # -------------------------------------------------------------------------
+    # Drum access
+    # -------------------------------------------------------------------------
+    def read(self, s, a):
+        if (s < 20):
+            return self.m[s][a]
+        if (s < 24):
+            return self.m[s][a & 0x3]
+        if (s < 27):
+            return self.m[s][a & 0x1]
+        if (s == 27):
+            m20 = self.m[20][a & 0x3]
+            return ((m20 & self.m[21][a & 0x3]) | (~m20 & self.ar)) & MASK29
+        if (s == 28):
+            return self.ar
+        if (s == 29):
+            # No input device drives the IN line
+            return 0
+        return self.m[20][a & 0x3] & self.m[21][a & 0x3]
+
+    def write(self, d, a, word):
+        if (d < 20):
+            self.m[d][a] = word
+        elif (d < 24):
+            self.m[d][a & 0x3] = word
+        else:
+            self.m[d][a & 0x1] = word
+        if (d in cmd_lines):
+            self.invalidate(d, a)
+
+    def invalidate(self, d, a):
+        # Drop the translation of the command a drum write replaces. A word
+        # of line 23 is read as every fourth word address.
+        if (d == 23):
+            for w in range(a & 0x3, WORDS, 4):
+                self.tcache.pop((d, w), None)
+        elif (d in cmd_lines):
+            self.tcache.pop((d, a), None)
+
+    # -------------------------------------------------------------------------
+    # Snapshots of the machine state: drum lines and registers, flip-flops,
+    # the command and I/O timing state and the tape position. The tape
+    # itself is not saved and must be mounted again to resume reading it.
+    # -------------------------------------------------------------------------
+    def save(self, snap_file):
+        flags = (self.ip | (self.fo << 1) | (self.cq << 2) | (self.cg << 3) |
+                 (self.is_ << 4) | (self.ic << 5))
+        snap_file.write(SNAP_HEADER.pack(SNAP_MAGIC, SNAP_VERSION, flags, self.ar,
+                                         self.cd, self.n, self.l, self.mark,
+                                         self.reader.pos, self.reader.chars, self.wt,
+                                         self.commands, self.io_ready_wt))
+        snap_file.write(SNAP_COUNTS.pack(*self.specials))
+        words = array("I")
+        for line in self.m:
+            words.extend(line)
+        if (sys.byteorder != "little"):
+            words.byteswap()
+        snap_file.write(words.tobytes())
+
+    def restore(self, snap_file):
+        # The snapshot is mapped and its words copied into the lines in
+        # place. Raises ValueError for a file that is not a snapshot.
+        try:
+            mm = mmap.mmap(snap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError("Empty snapshot file")
+        size = SNAP_HEADER.size + SNAP_COUNTS.size + 4 * SNAP_WORDS
+        with mm:
+            if (len(mm) != size):
+                raise ValueError("Invalid snapshot file size")
+            [magic, version, flags, self.ar, self.cd, self.n, self.l, self.mark,
+             tape_pos, tape_chars, self.wt, self.commands,
+             self.io_ready_wt] = SNAP_HEADER.unpack_from(mm, 0)
+            if (magic != SNAP_MAGIC or version != SNAP_VERSION):
+                raise ValueError("Invalid snapshot file")
+            self.specials = list(SNAP_COUNTS.unpack_from(mm, SNAP_HEADER.size))
+            start = SNAP_HEADER.size + SNAP_COUNTS.size
+            if (sys.byteorder == "little"):
+                words = memoryview(mm)[start:].cast("I")
+            else:
+                words = array("I", mm[start:])
+                words.byteswap()
+            pos = 0
+            for line in self.m:
+                line[:] = words[pos:pos + len(line)]
+                pos += len(line)
+            del words
+        self.reader.pos = tape_pos
+        self.reader.chars = tape_chars
+        self.ip = flags & 0x1
+        self.fo = (flags >> 1) & 0x1
+        self.cq = bool(flags & 0x4)
+        self.cg = bool(flags & 0x8)
+        self.is_ = (flags >> 4) & 0x1
+        self.ic = (flags >> 5) & 0x1
+        self.halted = False
+        self.stop_reason = ""
+        self.tcache.clear()
+
+    def get58(self, r):
+        # Magnitude of a two-word register: 28 bits of the even word above
+        # its sign position followed by all 29 bits of the odd word
+        return (self.m[r][1] << 28) | (self.m[r][0] >> 1)
+
+    def set58(self, r, mag):
+        self.m[r][0] = (mag & MASK28) << 1
+        self.m[r][1] = (mag >> 28) & MASK29
+
+    # -------------------------------------------------------------------------
+    # Command execution
+    # -------------------------------------------------------------------------
+    def run(self, max_wt):
+        self.limit = self.wt + max_wt
+        step = self.step if (self.profile is None) else self.step_profiled
+        while (not self.halted):
+            if (self.wt >= self.limit):
+                self.stop("word time limit")
+                break
+            step()
+        self.output.flush()
+        return self.stop_reason
+
+    def step(self):
+        # Wait to read command (WRC): the drum turns until word N arrives.
+        # With CQ set the command is read one word time later (RCnWT).
+        # Idle word times are skipped rather than stepped through.
+        self.wt += (self.n - self.wt) % WORDS
+        if (self.cq):
+            self.wt += 1
+        self.cq = False
+        l = self.wt % WORDS
+        self.l = l
+        if (self.cg):
+            # Commands executed from AR are not cached
+            word = self.ar
+            self.cg = False
+            execute = self.translate(l, word)
+        else:
+            line = cl_line[self.cd]
+            word = self.read(line, l)
+            key = (line, l)
+            entry = self.tcache.get(key)
+            if (entry is not None and entry[0] == word):
+                execute = entry[1]
+            else:
+                execute = self.translate(l, word)
+                self.tcache[key] = (word, execute)
+        if ((word >> 20) & 0x1 and self.bp_switch):
+            self.stop("breakpoint at " + cl_name[self.cd] + "[" + bin_to_dstr(l) + "]")
+            return
+        self.commands += 1
+        self.is_ = 0
+        self.ic = 0
+        # Read command (RC) occupies word time L
+        self.wt += 1
+        execute()
+
+    def next_command(self):
+        # [line, word address, command] step() will read next, without
+        # reading it. Commands taken from AR have line 28 (AR).
+        l = (self.wt + (self.n - self.wt) % WORDS + (1 if self.cq else 0)) % WORDS
+        if (self.cg):
+            return [28, l, self.ar]
+        line = cl_line[self.cd]
+        return [line, l, self.read(line, l)]
+
+    def step_profiled(self):
+        # step() with accounting per command address: the word times from RC
+        # to the end of the command, and the drum wait for N before it.
+        # Commands taken from AR are counted under line 28 (AR).
+        ready = self.wt + (self.n - self.wt) % WORDS + (1 if self.cq else 0)
+        wait = ready - self.wt
+        line = 28 if self.cg else cl_line[self.cd]
+        commands = self.commands
+        self.skipped = [0, 0]
+        self.step()
+        if (self.commands == commands):
+            return
+        key = (line, self.l)
+        entry = self.profile.get(key)
+        if (entry is None):
+            entry = [0, 0, 0, 0]
+            self.profile[key] = entry
+        # Each revolution of a Ready_Test loop that skip_ready_loop jumped
+        # over counts as a run of the command and a drum wait for N
+        [loops, period] = self.skipped
+        run = self.wt - ready - loops * period
+        entry[0] += 1 + loops
+        entry[1] += (1 + loops) * run
+        entry[2] += wait + loops * (period - run)
+        entry[3] = self.ar if (line == 28) else self.m[line][self.l if line < 20 else self.l & 0x3]
+
+    # -------------------------------------------------------------------------
+    # Command translation. A command word read at word address L always
+    # waits, transfers and moves on the same way, so it is decoded once
+    # into a closure that replays it. Translations are cached by line and
+    # word address and checked against the word read; writes to command
+    # lines drop the entries they replace (see invalidate).
+    # -------------------------------------------------------------------------
+    def translate(self, l, word):
+        [i_d, t, bp, n, ch, s, d, s_d, p, c] = decode_word(word)
+        if (d == 31):
+            def execute_special():
+                self.specials[s] += 1
+                self.special(i_d, t, n, ch, s, c, s_d)
+            return execute_special
+        t %= WORDS
+        if (i_d == 0):
+            # Immediate: transfer from L+1 through T-1
+            wait = 0
+            first = (l + 1) % WORDS
+            count = (t - l - 2) % WORDS + 1
+        else:
+            # Deferred: the carry that starts the transfer at T must
+            # arrive after RC, so T = L+1 waits a full revolution
+            wait = (t - l - 2) % WORDS + 1
+            first = t
+            count = 2 if (s_d == 1 and t % 2 == 0) else 1
+        addrs = [(first + i) % WORDS for i in range(count)]
+        transfer_words = self.translate_transfer(s, d, ch, s_d, addrs)
+        def execute_transfer():
+            self.wt += wait
+            transfer_words()
+            self.wt += count
+            self.n = n
+        return execute_transfer
+
+    def translate_transfer(self, s, d, ch, s_d, addrs):
+        # Common transfers between drum lines and into AR get their own
+        # loops; everything else goes word by word through transfer()
+        if (s < 24 and d < 24 and ch == 0):
+            # TR between lines copies the words unchanged
+            src = self.m[s]
+            dst = self.m[d]
+            sa = [a & 0x3 for a in addrs] if (s >= 20) else addrs
+            da = [a & 0x3 for a in addrs] if (d >= 20) else addrs
+            pairs = list(zip(sa, da))
+            def copy_words():
+                for x, y in pairs:
+                    dst[y] = src[x]
+                if (d in cmd_lines):
+                    for a in da:
+                        self.invalidate(d, a)
+            return copy_words
+        if (s < 24 and d == 29 and ch != 0):
+            # AD, SU and AV into AR+
+            src = self.m[s]
+            sa = [a & 0x3 for a in addrs] if (s >= 20) else addrs
+            keep = (MASK29 & ~0x1) if (ch == 2) else MASK29
+            flip = 0x1 if (ch == 3) else 0
+            def add_words():
+                for x in sa:
+                    v = (src[x] & keep) ^ flip
+                    self.add_ar(add_29(self.ar, v), v)
+            return add_words
+        if (s < 24 and d == 28 and ch == 0):
+            # TR to AR: only the last word stays
+            src = self.m[s]
+            x = (addrs[-1] & 0x3) if (s >= 20) else addrs[-1]
+            def load_ar():
+                self.ar = src[x]
+            return load_ar
+        if (s < 24 and d == 27 and ch == 0):
+            src = self.m[s]
+            sa = [a & 0x3 for a in addrs] if (s >= 20) else addrs
+            def test_words():
+                for x in sa:
+                    if (src[x] != 0):
+                        self.cq = True
+                        return
+            return test_words
+        transfer = self.transfer
+        def transfer_words():
+            for a in addrs:
+                transfer(s, d, ch, s_d, a)
+        return transfer_words
+
+    def wait_for(self, t):
+        # Wait to transfer (WTR) until word time T, at least one word after RC
+        self.wt += 1
+        self.wt += (t - self.wt) % WORDS
+
+    # -------------------------------------------------------------------------
+    # Transfer one word from source S to destination D. The characteristic
+    # is applied the way invert_gate_eb.sv does it on the serial bus: the
+    # sign is examined at sign time (every word in single precision, even
+    # words in double precision) and negative numbers are complemented by
+    # copying up through the first one bit and inverting the rest.
+    # -------------------------------------------------------------------------
+    def transfer(self, s, d, ch, s_d, a):
+        v = self.read(s, a)
+        ts = (s_d == 0) or (a & 0x1 == 0)
+        # Transfer via AR (TVA) or add via AR (AVA)
+        cs = (ch >= 2) and (s < 28) and (d < 28)
+        if (d == 28 or d == 29):
+            # AR and AR+ are one word long: every word is a full number.
+            # PN+ is two words long and keeps the double-precision timing.
+            ts = True
+        if (ts):
+            sign = v & 0x1
+            mag = v >> 1
+            bits = 28
+            self.ic = 0
+            if (ch == 1 or (ch == 3 and cs)):
+                # AD, AVA: complement negative numbers
+                self.is_ = sign
+            elif (ch == 3):
+                # SU: change sign, complement the now negative numbers
+                sign ^= 1
+                self.is_ = sign
+            elif (ch == 2 and not cs):
+                # AV: absolute value
+                sign = 0
+                self.is_ = 0
+            tr_tva = (ch == 0) or (ch == 2 and cs)
+            if (tr_tva and d >= 24 and d <= 26):
+                # The sign of MQ, ID and PN is kept in IP
+                if (s < 24 or s > 26):
+                    if (d == 25):
+                        self.ip = sign
+                    else:
+                        self.ip ^= sign
+                sign = 0
+            elif (tr_tva and s >= 24 and s <= 26):
+                sign = self.ip
+        else:
+            sign = 0
+            mag = v
+            bits = 29
+        if (self.is_):
+            if (self.ic):
+                mag = ~mag & ((1 << bits) - 1)
+            elif (mag != 0):
+                mag = -mag & ((1 << bits) - 1)
+                self.ic = 1
+        ib = ((mag << 1) | sign) if (bits == 28) else mag
+
+        if (cs):
+            # TVA/AVA: the old AR goes to D while the number enters AR
+            lb = self.ar
+            self.ar = ib
+        else:
+            lb = ib
+        if (d < 27):
+            self.write(d, a, lb)
+        elif (d == 27):
+            # TEST: any one bit reads the next command from N+1
+            if (lb != 0):
+                self.cq = True
+        elif (d == 28):
+            # A complemented minus zero carries into the AR sign
+            self.ar = ib ^ (self.is_ & (self.ic ^ 1))
+        elif (d == 29):
+            if (ch == 1):
+                self.add_ar(add_29(self.ar, v), v)
+            elif (ch == 3):
+                self.add_ar(add_29(self.ar, v ^ 0x1), v ^ 0x1)
+            elif (ch == 2):
+                self.add_ar(add_29(self.ar, v & ~0x1), v & ~0x1)
+            else:
+                # TR to AR+ adds the raw bits, sign included
+                sum = (rot_sign(self.ar) + rot_sign(ib)) & MASK29
+                self.add_ar(unrot_sign(sum) if (sum != 0x10000000) else 0, ib)
+        else:
+            self.add_pn(lb, a)
+
+    def add_ar(self, sum, addend):
+        # Overflow when numbers of like sign produce a sum of unlike sign
+        a_neg = self.ar & 0x1
+        b_neg = addend & 0x1 if ((addend >> 1) != 0) else 0
+        if (a_neg == b_neg and (sum & 0x1) != a_neg and sum != 0):
+            self.fo = 1
+        self.ar = sum
+
+    def add_pn(self, ib, a):
+        # PN+ adds into the 58-bit PN with its sign in bit 0 of the even
+        # word, using the same end-around sign arithmetic as AR
+        pn = ((self.m[26][0] & 0x1) << 57) | self.get58(26)
+        if (a & 0x1 == 0):
+            addend = ((ib & 0x1) << 57) | (ib >> 1)
+        else:
+            addend = ib << 28
+        sum = (pn + addend) & MASK58
+        if ((pn >> 57) == (addend >> 57) and (sum >> 57) != (pn >> 57)):
+            self.fo = 1
+        self.set58(26, sum)
+        self.m[26][0] |= sum >> 57
+
+    # -------------------------------------------------------------------------
+    # Special commands (D = 31)
+    # -------------------------------------------------------------------------
+    def special(self, i_d, t, n, ch, s, c, s_d):
+        start = self.wt
+        if (i_d == 0 and s >= 24 and s < 28):
+            # Relative timing: T counts word times from L+1
+            count = t if (t != 0) else WORDS
+            used = self.special_shift(s, ch, count)
+            self.wt = start + used
+            self.n = n
+            return
+        t %= WORDS
+        if (i_d == 0):
+            count = (t - start - 1) % WORDS + 1
+        else:
+            self.wait_for(t)
+            start = self.wt
+            count = 1
+        a = start % WORDS
+        self.n = n
+        if (s == 21):
+            # Mark_Exit: record this word time, continue in line C at N
+            self.mark = a
+            self.cd = c
+            count = 1
+        elif (s == 20):
+            # Return_Exit: continue in line C at the marked word time. The
+            # exit lasts until the word before the mark comes around.
+            self.cd = c
+            self.n = self.mark
+            count = (self.mark - a - 1) % WORDS + 1
+        elif (s == 16):
+            self.stop("HALT at " + cl_name[self.cd] + "[" + bin_to_dstr(self.l) + "]")
+        elif (s == 22):
+            if (self.ar & 0x1):
+                self.cq = True
+        elif (s == 23):
+            if (ch == 0):
+                # Clear MQ, ID, PN and IP
+                for r in range(24, 27):
+                    self.m[r][0] = 0
+                    self.m[r][1] = 0
+                self.ip = 0
+            elif (ch == 3):
+                # PN & M2 -> ID, PN & ~M2 -> PN for the words transferred
+                for i in range(min(count, 2)):
+                    w = (a + i) & 0x1
+                    m2 = self.m[2][(a + i) % WORDS]
+                    pn = self.m[26][w]
+                    self.m[25][w] = pn & m2
+                    self.m[26][w] = pn & ~m2 & MASK29
+        elif (s == 28):
+            if (ch == 0):
+                if (self.io_ready_wt > start + count - 1 and self.n == self.l):
+                    start = self.skip_ready_loop(start, count)
+                if (self.io_ready_wt <= start + count - 1):
+                    self.cq = True
+            elif (ch == 3):
+                # DA-1 is not attached, so it always tests off
+                self.cq = True
+        elif (s == 29):
+            if (self.fo):
+                self.cq = True
+                self.fo = 0
+        elif (s == 31):
+            if (ch == 0):
+                self.cg = True
+            elif (ch == 2):
+                for i in range(count):
+                    w = (a + i) % WORDS
+                    self.m[18][w] |= self.m[20][w & 0x3]
+        else:
+            count = self.special_io(s, ch, start, count)
+        self.wt = start + count
+
+    def skip_ready_loop(self, start, count):
+        # A Ready_Test that branches to itself only spins until READY. Jump
+        # over the revolutions that would fail the test, keeping the word
+        # time and command counts the loop would have accumulated.
+        period = WORDS * ((count + WORDS) // WORDS)
+        end = start + count - 1
+        loops = (self.io_ready_wt - end + period - 1) // period
+        loops = min(loops, max(0, (self.limit - end) // period))
+        self.commands += loops
+        self.specials[28] += loops
+        # Revolutions skipped, for step_profiled
+        self.skipped = [loops, period]
+        return start + loops * period
+
+    def special_shift(self, s, ch, count):
+        # Multiply, Divide, Shift and Normalize step once every two word
+        # times. The result of all the steps is computed at once where a
+        # closed form exists. Returns the word times used.
+        steps = count // 2
+        mq = self.get58(24)
+        id = self.get58(25)
+        pn = self.get58(26)
+        used = count
+        if (s == 24):
+            # When the ID bits the steps shift out (see multiply_steps) are
+            # all zero the partial products sum to ID times the top bits
+            # of MQ
+            low = (1 << (steps - 1)) - 1 if (steps > 0) else 0
+            if (steps <= 57 and (id & low) == 0):
+                if (steps > 0):
+                    pn = (pn + ((id * (mq >> (57 - steps))) >> (steps - 1))) & MASK57
+                id >>= steps
+                mq = (mq << steps) & MASK57
+            else:
+                [mq, id, pn] = multiply_steps(mq, id, pn, steps)
+        elif (s == 25):
+            if (ch != 1):
+                return count
+            if (steps > 0 and pn < 2 * id):
+                # Restoring division keeps the remainder below 2 ID, so the
+                # quotient bits are those of PN / ID to steps - 1 places
+                q = (pn << (steps - 1)) // id
+                pn = (pn << steps) - 2 * q * id
+                mq = ((mq << steps) | q) & MASK57
+            else:
+                [mq, pn] = divide_steps(mq, id, pn, steps)
+            if (pn > MASK57):
+                self.fo = 1
+        elif (s == 26):
+            # With CH 0 every step counts AR and the shift stops when the
+            # count overflows
+            shifts = steps
+            if (ch == 0):
+                to_overflow = MASK28 - (self.ar >> 1) + 1
+                if (to_overflow <= steps):
+                    shifts = to_overflow
+                    used = 2 * shifts
+                self.add_count_ar(shifts)
+            mq = (mq << shifts) & MASK57
+            id >>= shifts
+        else:
+            # Shift MQ left until its top bit is set
+            zeros = 57 - mq.bit_length()
+            if (mq != 0 and zeros < steps):
+                shifts = zeros
+                used = 2 * zeros if (zeros > 0) else 1
+            else:
+                shifts = steps
+            mq = (mq << shifts) & MASK57
+            if (ch == 0):
+                self.add_count_ar(shifts)
+        self.set58(24, mq)
+        self.set58(25, id)
+        self.set58(26, pn)
+        return used
+
+    def add_count_ar(self, k):
+        # Add k to the magnitude of AR. An overflow into the sign position
+        # flips the sign and the count carries on from zero.
+        mag = (self.ar >> 1) + k
+        if (mag > MASK28):
+            self.ar = (((mag - MASK28 - 1) & MASK28) << 1) | ((self.ar & 0x1) ^ 0x1)
+        else:
+            self.ar = (mag << 1) | (self.ar & 0x1)
+
+    # -------------------------------------------------------------------------
+    # Input/output. I/O runs concurrently with computing: starting an
+    # operation drops READY until the device has moved all its characters.
+    # The output formats held in lines 2 and 3 are not interpreted; numbers
+    # are typed and punched in the same sign, hexadecimal and reload/stop
+    # layout that print_pti_block and print_pt_block use.
+    # -------------------------------------------------------------------------
+    def special_io(self, s, ch, start, count):
+        if (s == 0):
+            # Set_Ready
+            self.io_ready_wt = start
+            return count
+        if (s not in (2, 3, 6, 7, 8, 9, 10, 15)):
+            # Bell, DA-1, card and magnetic tape commands: no device attached
+            return count
+        if (self.io_ready_wt > start):
+            # I/O section busy: the command waits for READY
+            count = max(count, self.io_ready_wt - start + 1)
+            start = self.io_ready_wt
+        if (s == 15):
+            [block, chars] = self.reader.read_block()
+            if (block is None):
+                self.stop("end of tape")
+                return count
+            # The block precesses into line 19 from word 0 up
+            m19 = self.m[19]
+            m19[:] = [w & MASK29 for w in block] + m19[:WORDS - len(block)]
+            for a in range(WORDS):
+                self.invalidate(19, a)
+            busy = chars_to_word_times(chars, READ_CPS)
+        elif (s == 6 or s == 7):
+            # Tape_Rev: back up one block
+            busy = chars_to_word_times(self.reader.reverse_block(), READ_CPS)
+        elif (s == 2):
+            # Fast_Pun_Leader
+            self.output.write("punch", start, 16 * " ", FAST_PUNCH_CPS)
+            busy = chars_to_word_times(16, FAST_PUNCH_CPS)
+        elif (s == 8):
+            text = word29_to_str(self.ar) + "\n"
+            self.output.write("type", start, text, TYPE_CPS)
+            busy = chars_to_word_times(len(text), TYPE_CPS)
+        else:
+            # Type, punch or fast punch line 19. The line is shifted out
+            # through the output register and left cleared.
+            text = m19_to_str(self.m[19])
+            self.m[19][:] = [0] * WORDS
+            for a in range(WORDS):
+                self.invalidate(19, a)
+            if (s == 9):
+                self.output.write("type", start, text, TYPE_CPS)
+                busy = chars_to_word_times(len(text), TYPE_CPS)
+            else:
+                cps = FAST_PUNCH_CPS if (s == 3) else PUNCH_CPS
+                self.output.write("punch", start, text, cps)
+                busy = chars_to_word_times(len(text), cps)
+        self.io_ready_wt = start + busy
+        return count
+
+# -----------------------------------------------------------------------------
+# Photo tape reader (hdl/sim/tape_reader.sv). The tape is the bytes of a
+# .pt file, one pt_codes character per byte, usually a read-only mapping
+# of the file itself. Blocks are found by searching for the stop code and
+# decoded a block at a time with pt_decode, so characters are never read
+# one by one. The position is the offset of the next character under the
+# photo cells and every character passed in either direction, blank tape
+# included, takes 1/READ_CPS seconds.
+# -----------------------------------------------------------------------------
+PT_STOP = bytes([pt_codes.index("S")])
+
+class PhotoReader:
+    def __init__(self, data=b""):
+        self.data = data
+        self.pos = 0
+        # Characters moved past the photo cells
+        self.chars = 0
+
+    def read_block(self):
+        # Move forward through the next stop code. Returns [block, characters
+        # passed]; the block is None when the tape runs out first.
+        start = min(self.pos, len(self.data))
+        stop = self.data.find(PT_STOP, start)
+        self.pos = (stop + 1) if (stop >= 0) else len(self.data)
+        chars = self.pos - start
+        self.chars += chars
+        if (stop < 0):
+            return [None, chars]
+        return [quads_to_block(self.data[start:self.pos].translate(pt_decode).decode("ascii")), chars]
+
+    def reverse_block(self):
+        # Move back to just after the stop code before the last one passed,
+        # so that the next read repeats the last block. Returns the
+        # characters passed.
+        start = min(self.pos, len(self.data))
+        self.pos = self.data.rfind(PT_STOP, 0, max(start - 1, 0)) + 1
+        self.chars += start - self.pos
+        return start - self.pos
+
+def open_pt_tape(pt_file):
+    # Photo reader with an open .pt file mapped as its tape
+    try:
+        data = mmap.mmap(pt_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # An empty file cannot be mapped
+        data = b""
+    return PhotoReader(data)
+
+# -----------------------------------------------------------------------------
+# Typewriter and punch output. Text is collected and written to the
+# console in large pieces rather than a character at a time. With a punch
+# file the punch output goes there instead, as a .pt image encoded the way
+# print_pt_block punches quads. With a log file every line typed or
+# punched is also logged with the word time the device starts on it.
+# -----------------------------------------------------------------------------
+# Characters held before they are written out
+OUT_FLUSH_CHARS = 1 << 16
+
+class OutputSink:
+    def __init__(self, out_file=None, punch_file=None, log_file=None):
+        self.out_file = out_file if (out_file is not None) else sys.stdout
+        self.punch_file = punch_file
+        self.log_file = log_file
+        self.pending = []
+        self.pending_chars = 0
+        self.punch = bytearray()
+        # Characters typed and punched
+        self.typed = 0
+        self.punched = 0
+
+    def write(self, device, wt, text, cps):
+        # Output text on device ("type" or "punch") starting at word time wt
+        if (device == "type"):
+            self.typed += len(text)
+        else:
+            self.punched += len(text)
+        if (self.log_file is not None):
+            chars = 0
+            for line in text.splitlines(True):
+                when = wt + (chars_to_word_times(chars, cps) if (chars != 0) else 0)
+                print("{:11d} ".format(when) + device + ": " + line.rstrip("\n"),
+                      file=self.log_file)
+                chars += len(line)
+        if (device == "punch" and self.punch_file is not None):
+            self.punch += text.replace("\n", "").encode().translate(pt_encode)
+            if (len(self.punch) >= OUT_FLUSH_CHARS):
+                self.flush()
+            return
+        self.pending.append(text)
+        self.pending_chars += len(text)
+        if (self.pending_chars >= OUT_FLUSH_CHARS):
+            self.flush()
+
+    def flush(self):
+        if (self.pending):
+            self.out_file.write("".join(self.pending))
+            self.out_file.flush()
+            self.pending = []
+            self.pending_chars = 0
+        if (self.punch):
+            self.punch_file.write(self.punch)
+            self.punch = bytearray()
+
+def m19_to_str(block):
+    # Quads of line 19 from word 107 down, as print_pti_block lays them out
+    return "".join([quad_str + "\n" for quad_str in block_to_quads(block)])
+
+# -----------------------------------------------------------------------------
+# Reporting
+# -----------------------------------------------------------------------------
+def print_state(g15, out_file=None):
+    if (out_file is None):
+        out_file = sys.stdout
+    print("Stopped:", g15.stop_reason, file=out_file)
+    print("Word times:", g15.wt, "(" + format(g15.wt * WORD_TIME_US / 1e6, ".3f"),
+          "s drum time)", "Commands:", g15.commands, file=out_file)
+    print("Next command:", cl_name[g15.cd] + "[" + bin_to_dstr(g15.n) + "]",
+          file=out_file)
+    print("AR:", word29_to_str(g15.ar), " IP:", g15.ip, " FO:", g15.fo,
+          file=out_file)
+    for r, name in [(24, "MQ"), (25, "ID"), (26, "PN")]:
+        print(name + ":", word29_to_str(g15.m[r][1]), word29_to_str(g15.m[r][0]),
+              file=out_file)
+    if (len(g15.reader.data) != 0):
+        print("Photo reader: character", g15.reader.pos, "of", len(g15.reader.data),
+              " moved:", g15.reader.chars, "(" + format(g15.reader.chars / READ_CPS, ".3f"),
+              "s)", file=out_file)
+    if (g15.output.typed != 0 or g15.output.punched != 0):
+        print("Typewriter:", g15.output.typed, "characters  Punch:", g15.output.punched,
+              "characters", file=out_file)
+    specials = []
+    for s in range(32):
+        if (g15.specials[s] != 0):
+            specials.append(sc_name[s] + "=" + str(g15.specials[s]))
+    if (specials):
+        print("Special commands:", " ".join(specials), file=out_file)
+
+def print_profile(g15, out_file=None):
+    # Annotated listing of the commands executed, by line and word address
+    if (out_file is None):
+        out_file = sys.stdout
+    print("Profile: commands, word times (RC to end), drum wait for N", file=out_file)
+    print("Word times:", g15.wt, "Commands:", g15.commands, file=out_file)
+    line = -1
+    for key in sorted(g15.profile):
+        [count, wt, wait, word] = g15.profile[key]
+        if (key[0] != line):
+            line = key[0]
+            print("\nLine " + ("AR" if (line == 28) else bin_to_dstr(line)) + ":", file=out_file)
+        print("    " + bin_to_dstr(key[1]) + ": " + command_to_pprasm(word) +
+              "   # " + "{:9d} {:11d} {:11d}".format(count, wt, wait) + "  " +
+              command_to_semantics(word, key[1]), file=out_file)
+    specials = []
+    for s in range(32):
+        if (g15.specials[s] != 0):
+            specials.append(sc_name[s] + "=" + str(g15.specials[s]))
+    if (specials):
+        print("\nSpecial commands:", " ".join(specials), file=out_file)
+
+def profile_summary(g15):
+    # The profile as plain data for json.dump
+    return {"word_times": g15.wt,
+            "commands": g15.commands,
+            "specials": {sc_name[s]: g15.specials[s] for s in range(32) if (g15.specials[s] != 0)},
+            "addresses": [{"line": line, "word": word,
+                           "command": g15.profile[(line, word)][3],
+                           "count": g15.profile[(line, word)][0],
+                           "word_times": g15.profile[(line, word)][1],
+                           "wait": g15.profile[(line, word)][2]}
+                          for (line, word) in sorted(g15.profile)]}
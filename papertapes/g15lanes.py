@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Bendix G-15 lane-parallel emulator
+
+# Runs many G-15s at once for parameter sweeps: the same program started
+# with different AR, MQ or drum contents. The machine state of g15emu.G15
+# is held in NumPy arrays with one lane (column) per machine, and each
+# command is applied to every lane that reads it at the same time:
+#
+#   - Lanes are grouped by the next command they read: command line, word
+#     address, CQ, CG and the command word itself. The group holding the
+#     lane furthest behind in word time executes next.
+#   - A command word decodes the same way in every lane of a group, so the
+#     wait, the word addresses transferred and the characteristic are
+#     scalars and only the data is vectorized. Lanes that branch
+#     differently (TEST, Test_Sign, overflow, Return_Exit) simply fall into
+#     different groups at the next command.
+#   - Additions use add_29_batch, the vectorized add_29, and the overflow
+#     and sign rules of G15.transfer, add_ar and add_pn word for word.
+#
+# Timing is per lane and matches G15.run exactly. Input/output commands
+# other than Set_Ready and the commands that need no device stop the
+# lanes that read them ("I/O"). The lanes are driven by "g15util.py sweep".
+# NumPy is required.
+
+import sys
+
+from g15util import decode_word, add_29_batch, word29_to_str, bin_to_dstr, cl_name
+from g15emu import (WORDS, MASK28, MASK29, MASK57, MASK58, cl_line,
+                    SNAP_WORDS, rot_sign, unrot_sign)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Row of word 0 and the number of words of each line in the lane memory:
+# lines 0-19, 20-23 and the two-word registers 24-26, as in a snapshot
+line_row = [WORDS * r for r in range(20)] + [20 * WORDS + 4 * r for r in range(4)] + \
+           [20 * WORDS + 16 + 2 * r for r in range(3)]
+line_size = 20 * [WORDS] + 4 * [4] + 3 * [2]
+
+# Lane stop codes and their reasons (see G15Lanes.stop_reason)
+STOP_NONE = 0
+STOP_HALT = 1
+STOP_LIMIT = 2
+STOP_BREAKPOINT = 3
+STOP_IO = 4
+stop_names = ["", "HALT", "word time limit", "breakpoint", "I/O"]
+
+# I/O specials that need a device. The lane emulator has none attached.
+io_specials = frozenset([2, 3, 6, 7, 8, 9, 10, 15])
+
+class G15Lanes:
+    def __init__(self, lanes):
+        if (np is None):
+            raise ImportError("The lane emulator needs NumPy")
+        self.lanes = lanes
+        # One row per drum word (lines 0-26, see line_row), one column per lane
+        self.mem = np.zeros((SNAP_WORDS, lanes), dtype=np.uint32)
+        z = lambda dtype: np.zeros(lanes, dtype=dtype)
+        self.ar = z(np.int64)
+        self.ip = z(np.int64)
+        self.fo = z(np.int64)
+        self.wt = z(np.int64)
+        self.cd = z(np.int64)
+        self.n = z(np.int64)
+        self.l = z(np.int64)
+        self.cq = z(bool)
+        self.cg = z(bool)
+        self.mark = z(np.int64)
+        self.is_ = z(np.int64)
+        self.ic = z(np.int64)
+        self.halted = z(bool)
+        self.stop_code = z(np.int8)
+        self.limit = z(np.int64)
+        self.commands = z(np.int64)
+        self.specials = np.zeros((32, lanes), dtype=np.int64)
+        self.io_ready_wt = z(np.int64)
+        self.bp_switch = False
+        # Decoded commands: (word address, command word) -> closure(lanes)
+        self.tcache = {}
+        self.cl_line = np.array(cl_line, dtype=np.int64)
+        self.cl_row = np.array([line_row[r] for r in cl_line], dtype=np.int64)
+        self.cl_size = np.array([line_size[r] for r in cl_line], dtype=np.int64)
+
+    def load(self, line, block, origin=0, lanes=slice(None)):
+        # Load a block into the given lanes (default: all of them)
+        for i in range(len(block)):
+            self.mem[self.row(line, origin + i), lanes] = block[i] & MASK29
+
+    def row(self, line, a):
+        return line_row[line] + (a % WORDS) % line_size[line]
+
+    def stop(self, idx, code):
+        self.halted[idx] = True
+        self.stop_code[idx] = code
+
+    def stop_reason(self, k):
+        # The reason lane k stopped, worded as G15.stop_reason
+        code = int(self.stop_code[k])
+        if (code == STOP_HALT or code == STOP_BREAKPOINT or code == STOP_IO):
+            where = cl_name[int(self.cd[k])] + "[" + bin_to_dstr(int(self.l[k])) + "]"
+            return ("HALT" if (code == STOP_HALT) else stop_names[code]) + " at " + where
+        return stop_names[code]
+
+    # -------------------------------------------------------------------------
+    # Drum access for the lanes in idx
+    # -------------------------------------------------------------------------
+    def read(self, s, a, idx):
+        if (s < 27):
+            return self.mem[self.row(s, a), idx].astype(np.int64)
+        if (s == 28):
+            return self.ar[idx]
+        if (s == 29):
+            return np.zeros(len(idx), dtype=np.int64)
+        m20 = self.mem[self.row(20, a), idx].astype(np.int64)
+        m21 = self.mem[self.row(21, a), idx].astype(np.int64)
+        if (s == 27):
+            return ((m20 & m21) | (~m20 & self.ar[idx])) & MASK29
+        return m20 & m21
+
+    def write(self, d, a, word, idx):
+        self.mem[self.row(d, a), idx] = word
+
+    def get58(self, r, idx):
+        return ((self.mem[line_row[r] + 1, idx].astype(np.int64) << 28) |
+                (self.mem[line_row[r], idx].astype(np.int64) >> 1))
+
+    def set58(self, r, mag, idx):
+        self.mem[line_row[r], idx] = (mag & MASK28) << 1
+        self.mem[line_row[r] + 1, idx] = (mag >> 28) & MASK29
+
+    # -------------------------------------------------------------------------
+    # Command execution
+    # -------------------------------------------------------------------------
+    def run(self, max_wt):
+        # Run every lane until it stops or has run max_wt more word times
+        self.limit[:] = self.wt + max_wt
+        while (self.step()):
+            pass
+
+    def step(self):
+        # Execute the next command of one group of lanes. Returns False once
+        # every lane has stopped.
+        act = np.flatnonzero(~self.halted)
+        over = self.wt[act] >= self.limit[act]
+        if (over.any()):
+            self.stop(act[over], STOP_LIMIT)
+            act = act[~over]
+        if (act.size == 0):
+            return False
+        # The word time each lane reads its next command at (see G15.step)
+        ready = self.wt[act] + (self.n[act] - self.wt[act]) % WORDS + self.cq[act]
+        l = ready % WORDS
+        cd = self.cd[act]
+        word = self.mem[self.cl_row[cd] + l % self.cl_size[cd], act].astype(np.int64)
+        cg = self.cg[act]
+        word = np.where(cg, self.ar[act], word)
+        k = int(np.argmin(ready))
+        same = ((l == l[k]) & (cd == cd[k]) & (cg == cg[k]) & (word == word[k]))
+        idx = act[same]
+        l = int(l[k])
+        word = int(word[k])
+        self.wt[idx] = ready[same]
+        self.cq[idx] = False
+        self.cg[idx] = False
+        self.l[idx] = l
+        if ((word >> 20) & 0x1 and self.bp_switch):
+            self.stop(idx, STOP_BREAKPOINT)
+            return True
+        execute = self.tcache.get((l, word))
+        if (execute is None):
+            execute = self.translate(l, word)
+            self.tcache[(l, word)] = execute
+        execute(idx)
+        return True
+
+    def translate(self, l, word):
+        # As G15.translate, with closures over the lanes they execute for
+        [i_d, t, bp, n, ch, s, d, s_d, p, c] = decode_word(word)
+        if (d == 31):
+            if (s in io_specials):
+                def stop_io(idx):
+                    self.stop(idx, STOP_IO)
+                return stop_io
+            def execute_special(idx):
+                self.commands[idx] += 1
+                self.is_[idx] = 0
+                self.ic[idx] = 0
+                self.wt[idx] += 1
+                self.specials[s, idx] += 1
+                self.special(idx, l, i_d, t, n, ch, s, c)
+            return execute_special
+        t %= WORDS
+        if (i_d == 0):
+            wait = 0
+            first = (l + 1) % WORDS
+            count = (t - l - 2) % WORDS + 1
+        else:
+            wait = (t - l - 2) % WORDS + 1
+            first = t
+            count = 2 if (s_d == 1 and t % 2 == 0) else 1
+        addrs = [(first + i) % WORDS for i in range(count)]
+        def execute_transfer(idx):
+            self.commands[idx] += 1
+            self.is_[idx] = 0
+            self.ic[idx] = 0
+            self.wt[idx] += 1 + wait
+            for a in addrs:
+                self.transfer(idx, s, d, ch, s_d, a)
+            self.wt[idx] += count
+            self.n[idx] = n
+        return execute_transfer
+
+    # -------------------------------------------------------------------------
+    # Transfer one word from S to D in the lanes of idx (see G15.transfer)
+    # -------------------------------------------------------------------------
+    def transfer(self, idx, s, d, ch, s_d, a):
+        v = self.read(s, a, idx)
+        ts = (s_d == 0) or (a & 0x1 == 0)
+        cs = (ch >= 2) and (s < 28) and (d < 28)
+        if (d == 28 or d == 29):
+            ts = True
+        is_ = self.is_[idx]
+        if (ts):
+            sign = v & 0x1
+            mag = v >> 1
+            bits = 28
+            ic = np.zeros(len(idx), dtype=np.int64)
+            if (ch == 1 or (ch == 3 and cs)):
+                is_ = sign
+            elif (ch == 3):
+                sign = sign ^ 1
+                is_ = sign
+            elif (ch == 2 and not cs):
+                sign = np.zeros(len(idx), dtype=np.int64)
+                is_ = sign
+            tr_tva = (ch == 0) or (ch == 2 and cs)
+            if (tr_tva and d >= 24 and d <= 26):
+                if (s < 24 or s > 26):
+                    if (d == 25):
+                        self.ip[idx] = sign
+                    else:
+                        self.ip[idx] ^= sign
+                sign = 0
+            elif (tr_tva and s >= 24 and s <= 26):
+                sign = self.ip[idx]
+        else:
+            sign = 0
+            mag = v
+            bits = 29
+            ic = self.ic[idx]
+        mask = (1 << bits) - 1
+        # Complement: inverted after the first one bit (IC), else negated
+        comp = np.where(ic == 1, ~mag & mask, -mag & mask)
+        ic = np.where((is_ == 1) & (mag != 0), 1, ic)
+        mag = np.where(is_ == 1, comp, mag)
+        self.is_[idx] = is_
+        self.ic[idx] = ic
+        ib = ((mag << 1) | sign) if (bits == 28) else mag
+
+        if (cs):
+            lb = self.ar[idx]
+            self.ar[idx] = ib
+        else:
+            lb = ib
+        if (d < 27):
+            self.write(d, a, lb, idx)
+        elif (d == 27):
+            self.cq[idx] |= (lb != 0)
+        elif (d == 28):
+            self.ar[idx] = ib ^ (is_ & (ic ^ 1))
+        elif (d == 29):
+            if (ch == 0):
+                sum = (rot_sign(self.ar[idx]) + rot_sign(ib)) & MASK29
+                self.add_ar(idx, np.where(sum != 0x10000000, unrot_sign(sum), 0), ib)
+            else:
+                if (ch == 1):
+                    addend = v
+                elif (ch == 3):
+                    addend = v ^ 0x1
+                else:
+                    addend = v & ~0x1
+                self.add_ar(idx, add_29_batch(self.ar[idx], addend).astype(np.int64), addend)
+        else:
+            self.add_pn(idx, lb, a)
+
+    def add_ar(self, idx, sum, addend):
+        a_neg = self.ar[idx] & 0x1
+        b_neg = np.where((addend >> 1) != 0, addend & 0x1, 0)
+        self.fo[idx] |= (a_neg == b_neg) & ((sum & 0x1) != a_neg) & (sum != 0)
+        self.ar[idx] = sum
+
+    def add_pn(self, idx, ib, a):
+        pn = ((self.mem[line_row[26], idx].astype(np.int64) & 0x1) << 57) | self.get58(26, idx)
+        if (a & 0x1 == 0):
+            addend = ((ib & 0x1) << 57) | (ib >> 1)
+        else:
+            addend = ib << 28
+        sum = (pn + addend) & MASK58
+        self.fo[idx] |= ((pn >> 57) == (addend >> 57)) & ((sum >> 57) != (pn >> 57))
+        self.set58(26, sum, idx)
+        self.mem[line_row[26], idx] |= (sum >> 57).astype(np.uint32)
+
+    # -------------------------------------------------------------------------
+    # Special commands (see G15.special). Every lane of a group reads the
+    # command at the same word address, so the word counts only differ by
+    # lane for Return_Exit and the shifts.
+    # -------------------------------------------------------------------------
+    def special(self, idx, l, i_d, t, n, ch, s, c):
+        start = self.wt[idx]
+        if (i_d == 0 and s >= 24 and s < 28):
+            count = t if (t != 0) else WORDS
+            self.wt[idx] = start + self.special_shift(idx, s, ch, count)
+            self.n[idx] = n
+            return
+        t %= WORDS
+        a = (l + 1) % WORDS
+        if (i_d == 0):
+            count = (t - a - 1) % WORDS + 1
+        else:
+            # Wait for T, at least one word after RC
+            wait = 1 + (t - a - 1) % WORDS
+            start = start + wait
+            a = (a + wait) % WORDS
+            count = 1
+        self.n[idx] = n
+        if (s == 21):
+            self.mark[idx] = a
+            self.cd[idx] = c
+            count = 1
+        elif (s == 20):
+            self.cd[idx] = c
+            self.n[idx] = self.mark[idx]
+            count = (self.mark[idx] - a - 1) % WORDS + 1
+        elif (s == 16):
+            self.stop(idx, STOP_HALT)
+        elif (s == 22):
+            self.cq[idx] |= (self.ar[idx] & 0x1) != 0
+        elif (s == 23):
+            if (ch == 0):
+                self.mem[line_row[24]:line_row[26] + 2, idx] = 0
+                self.ip[idx] = 0
+            elif (ch == 3):
+                for i in range(min(count, 2)):
+                    w = (a + i) & 0x1
+                    m2 = self.mem[self.row(2, a + i), idx]
+                    pn = self.mem[line_row[26] + w, idx]
+                    self.mem[line_row[25] + w, idx] = pn & m2
+                    self.mem[line_row[26] + w, idx] = pn & ~m2
+        elif (s == 28):
+            if (ch == 0):
+                self.cq[idx] |= self.io_ready_wt[idx] <= start + count - 1
+            elif (ch == 3):
+                self.cq[idx] = True
+        elif (s == 29):
+            self.cq[idx] |= self.fo[idx] != 0
+            self.fo[idx] = 0
+        elif (s == 31):
+            if (ch == 0):
+                self.cg[idx] = True
+            elif (ch == 2):
+                for i in range(count):
+                    w = (a + i) % WORDS
+                    self.mem[self.row(18, w), idx] |= self.mem[self.row(20, w), idx]
+        elif (s == 0):
+            # Set_Ready
+            self.io_ready_wt[idx] = start
+        self.wt[idx] = start + count
+
+    def special_shift(self, idx, s, ch, count):
+        # Multiply, Divide, Shift and Normalize one step at a time across
+        # the lanes. Returns the word times used by each lane.
+        steps = count // 2
+        mq = self.get58(24, idx)
+        id = self.get58(25, idx)
+        pn = self.get58(26, idx)
+        used = np.full(len(idx), count, dtype=np.int64)
+        if (s == 24):
+            for i in range(steps):
+                pn = np.where(((mq >> 56) & 0x1) != 0, (pn + id) & MASK57, pn)
+                id >>= 1
+                mq = (mq << 1) & MASK57
+        elif (s == 25):
+            if (ch != 1):
+                return used
+            for i in range(steps):
+                q = pn >= id
+                pn = ((pn - np.where(q, id, 0)) << 1) & MASK58
+                mq = ((mq << 1) | q) & MASK57
+            self.fo[idx] |= pn > MASK57
+        elif (s == 26):
+            shifts = np.full(len(idx), steps, dtype=np.int64)
+            if (ch == 0):
+                to_overflow = MASK28 - (self.ar[idx] >> 1) + 1
+                stop = to_overflow <= steps
+                shifts = np.where(stop, to_overflow, shifts)
+                used = np.where(stop, 2 * shifts, used)
+                self.add_count_ar(idx, shifts)
+            mq = (mq << shifts) & MASK57
+            id >>= shifts
+        else:
+            zeros = 57 - bit_length(mq)
+            stop = (mq != 0) & (zeros < steps)
+            shifts = np.where(stop, zeros, steps)
+            used = np.where(stop, np.where(zeros > 0, 2 * zeros, 1), used)
+            mq = (mq << shifts) & MASK57
+            if (ch == 0):
+                self.add_count_ar(idx, shifts)
+        self.set58(24, mq, idx)
+        self.set58(25, id, idx)
+        self.set58(26, pn, idx)
+        return used
+
+    def add_count_ar(self, idx, k):
+        ar = self.ar[idx]
+        mag = (ar >> 1) + k
+        over = mag > MASK28
+        self.ar[idx] = np.where(over, (((mag - MASK28 - 1) & MASK28) << 1) | ((ar & 0x1) ^ 0x1),
+                                (mag << 1) | (ar & 0x1))
+
+def bit_length(x):
+    # int.bit_length of each element of a non-negative int64 array
+    x = x.copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = (x >> shift) != 0
+        length += np.where(high, shift, 0)
+        x = np.where(high, x >> shift, x)
+    return length + (x != 0)
+
+# -----------------------------------------------------------------------------
+# Reporting
+# -----------------------------------------------------------------------------
+def print_lanes(g, values, out_file=None):
+    # One line per lane: the value it started with, why it stopped, its
+    # word times and commands and the final AR and MQ
+    if (out_file is None):
+        out_file = sys.stdout
+    print("Lanes:", g.lanes, "Word times:", int(g.wt.max()) if (g.lanes > 0) else 0,
+          file=out_file)
+    for k in range(g.lanes):
+        mq = g.mem[line_row[24]:line_row[24] + 2, k]
+        print("{:6d}".format(k) + ":" + word29_to_str(values[k]) + " -> " +
+              g.stop_reason(k) + ", " + str(int(g.wt[k])) + " word times, " +
+              str(int(g.commands[k])) + " commands, AR:" + word29_to_str(int(g.ar[k])) +
+              " MQ:" + word29_to_str(int(mq[1])) + word29_to_str(int(mq[0])), file=out_file)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+# Bendix G-15 HDL trace decoder
+
+# Reassembles drum words from simulation traces of the HDL:
+#   VCD files       serial signals (e.g. M0_in, AA, CN_in) are sampled on the
+#                   rising edge of CLOCK the way g15_alpha_ut.sv fills its
+#                   debug buffers: the sample taken with T29 set is bit 28
+#                   of a word, the next one bit 0 (T1) of the next word, and
+#                   a word ending with T0 set is word 107.
+#   $display logs   the RC@ and register dumps g15_alpha_ut.sv prints with
+#                   print_word.
+# Both are read a line at a time so traces need not fit in memory. Serial
+# bits are collected in chunks and packed into words with NumPy when it is
+# available. The decoder is driven by "g15util.py trace".
+
+import sys
+import re
+import collections
+
+from g15util import (word29_to_str, bin_to_dstr, command_to_pprasm,
+                     command_to_semantics)
+from g15emu import cl_line
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional: words are then packed one at a time
+    np = None
+
+# Clock samples collected before words are packed
+VCD_CHUNK = 29 * 108 * 64
+
+# -----------------------------------------------------------------------------
+# VCD files
+# -----------------------------------------------------------------------------
+def vcd_signal_ids(vcd_file, names):
+    # Read the VCD header up to $enddefinitions. Returns the identifier
+    # code of each name, which may be a full hierarchical name or just the
+    # last component of one.
+    ids = {}
+    scope = []
+    for line in vcd_file:
+        tokens = line.split()
+        if (tokens == []):
+            continue
+        if (tokens[0] == "$scope"):
+            scope.append(tokens[2])
+        elif (tokens[0] == "$upscope"):
+            scope.pop()
+        elif (tokens[0] == "$var"):
+            code = tokens[3]
+            ref = tokens[4]
+            full = ".".join(scope + [ref])
+            for name in names:
+                if (name not in ids and (name == full or name == ref)):
+                    ids[name] = code
+        elif (tokens[0] == "$enddefinitions"):
+            break
+    for name in names:
+        if (name not in ids):
+            raise ValueError("Signal not found in VCD file: " + name)
+    return ids
+
+def iter_vcd_samples(vcd_file, names):
+    # Yield chunks of samples taken at each rising edge of names[0] (the
+    # clock): one bytearray of 0/1 values per name. The values sampled are
+    # those before the changes made at the time of the edge, as the
+    # testbench sees them.
+    ids = vcd_signal_ids(vcd_file, names)
+    index = {}
+    for i in range(len(names)):
+        index.setdefault(ids[names[i]], []).append(i)
+    clock_code = ids[names[0]]
+    values = [0] * len(names)
+    chunk = [bytearray() for name in names]
+    pending = []
+    rising = False
+    for line in vcd_file:
+        c = line[:1]
+        if (c == "#"):
+            if (rising):
+                for i in range(len(names)):
+                    chunk[i].append(values[i])
+                if (len(chunk[0]) >= VCD_CHUNK):
+                    yield chunk
+                    chunk = [bytearray() for name in names]
+            for [i, v] in pending:
+                values[i] = v
+            pending = []
+            rising = False
+            continue
+        if (c in "01xzXZ"):
+            code = line[1:].strip()
+            bit = 1 if (c == "1") else 0
+        elif (c in "bB"):
+            fields = line[1:].split()
+            if (len(fields) != 2):
+                continue
+            code = fields[1]
+            bit = 1 if (fields[0][-1:] == "1") else 0
+        else:
+            continue
+        if (code in index):
+            if (code == clock_code and bit == 1 and values[0] == 0):
+                rising = True
+            for i in index[code]:
+                pending.append([i, bit])
+    if (rising):
+        for i in range(len(names)):
+            chunk[i].append(values[i])
+    if (len(chunk[0]) != 0):
+        yield chunk
+
+def pack_words(bits, ends):
+    # Words of 29 samples (bit 0 first) ending at each index of ends
+    if (np is not None):
+        samples = np.frombuffer(bytes(bits), dtype=np.uint8)
+        idx = np.asarray(ends, dtype=np.int64)[:, None] - 28 + np.arange(29)
+        weights = np.left_shift(np.uint32(1), np.arange(29, dtype=np.uint32))
+        return (samples[idx].astype(np.uint32) * weights).sum(axis=1, dtype=np.uint32).tolist()
+    words = []
+    for end in ends:
+        word = 0
+        for b in range(29):
+            word |= bits[end - 28 + b] << b
+        words.append(word)
+    return words
+
+def iter_vcd_words(vcd_file, clock, t29, t0, signals):
+    # Yield [word time, word address, words] for every word time of the
+    # trace, words holding one word per signal. A word is the 29 samples up
+    # to one with T29 set; samples before the first complete word are
+    # dropped. The word address is None before the first word ending with
+    # T0 set, which is word 107.
+    names = [clock, t29, t0] + signals
+    carry = [bytearray() for name in names]
+    wt = 0
+    addr = None
+    for chunk in iter_vcd_samples(vcd_file, names):
+        bits = [carry[i] + chunk[i] for i in range(len(names))]
+        sync = bits[1]
+        ends = []
+        i = sync.find(1, 28)
+        while (i >= 0):
+            ends.append(i)
+            i = sync.find(1, i + 1)
+        packed = [pack_words(bits[3 + s], ends) for s in range(len(signals))]
+        for k in range(len(ends)):
+            if (bits[2][ends[k]]):
+                addr = 107
+            yield [wt, addr, [packed[s][k] for s in range(len(signals))]]
+            wt += 1
+            if (addr is not None):
+                addr = (addr + 1) % 108
+        last = ends[-1] + 1 if (ends != []) else 0
+        carry = [b[last:] for b in bits]
+
+# -----------------------------------------------------------------------------
+# $display logs of g15_alpha_ut.sv
+# -----------------------------------------------------------------------------
+rc_re = re.compile(r"RC@(M\d+|AR)\s*(?:\(\s*(\d+)\))?\s*:\s*([0-9a-fA-F]{8})")
+dump_re = re.compile(r"\s*(\d*)\s*:\s*([0-9a-fA-F]{8})\s")
+name_re = re.compile(r"\s*([A-Z][A-Z0-9]*):\s*$")
+
+def iter_display_log(log_file):
+    # Yield ["RC", line name, word address, command] for each command read
+    # and [register or line name, words] for each dump
+    name = None
+    words = []
+    for text in log_file:
+        m = rc_re.match(text)
+        if (m):
+            if (name is not None):
+                yield [name, words]
+                name = None
+            addr = int(m.group(2)) if (m.group(2) is not None) else None
+            yield ["RC", m.group(1), addr, int(m.group(3), 16) & 0x1fffffff]
+            continue
+        m = name_re.match(text)
+        if (m):
+            if (name is not None):
+                yield [name, words]
+            name = m.group(1)
+            words = []
+            continue
+        m = dump_re.match(text)
+        if (m and name is not None):
+            words.append(int(m.group(2), 16) & 0x1fffffff)
+            continue
+        if (name is not None):
+            yield [name, words]
+            name = None
+    if (name is not None):
+        yield [name, words]
+
+# -----------------------------------------------------------------------------
+# Listings
+# -----------------------------------------------------------------------------
+def word_text(word, addr, disassemble):
+    text = word29_to_str(word)
+    if (disassemble):
+        text += "  " + command_to_pprasm(word) + "  # " + command_to_semantics(word, addr if (addr is not None) else 0)
+    return text
+
+def print_vcd_words(records, signals, disassemble, out_file=None):
+    if (out_file is None):
+        out_file = sys.stdout
+    for [wt, addr, words] in records:
+        where = bin_to_dstr(addr) if (addr is not None) else "--"
+        for s in range(len(signals)):
+            print(str(wt) + " " + where + ": " + signals[s] + " " +
+                  word_text(words[s], addr, disassemble), file=out_file)
+
+def print_display_log(records, disassemble, out_file=None):
+    if (out_file is None):
+        out_file = sys.stdout
+    for record in records:
+        if (record[0] == "RC"):
+            [kind, line, addr, word] = record
+            where = line + ("[" + bin_to_dstr(addr) + "]" if (addr is not None) else "")
+            print("RC " + where + ": " + command_to_pprasm(word) + "   # " +
+                  command_to_semantics(word, addr if (addr is not None) else 0), file=out_file)
+        else:
+            [name, words] = record
+            print(name + ":", file=out_file)
+            for addr in range(len(words)):
+                print("    " + bin_to_dstr(addr) + ": " + word_text(words[addr], addr, disassemble),
+                      file=out_file)
+
+# -----------------------------------------------------------------------------
+# Co-simulation: the emulator follows a $display log command by command.
+# At each RC of the log the emulator finishes its previous command and
+# looks at the next one without executing it, so the dumps that follow
+# the RC (AR, M23) are compared with the state the command was read in.
+# Dumps outside an RC (the testbench's full dumps of ID, MQ, PN and the
+# drum lines) are compared with the state at the last command read.
+# -----------------------------------------------------------------------------
+# Dumps compared, by name: [drum line or 28 for AR, words]. MZ, CM and CN
+# have no emulator counterpart.
+cosim_dumps = {"AR": [28, 1], "MQ": [24, 2], "ID": [25, 2], "PN": [26, 2]}
+for line in range(24):
+    cosim_dumps["M" + str(line)] = [line, 108 if (line < 20) else 4]
+
+def cosim_where(line, addr):
+    return ("AR" if (line == 28) else "M" + str(line)) + "[" + bin_to_dstr(addr) + "]"
+
+def cosim(g15, records, context, max_wt, out_file=None):
+    # Returns True when the log and the emulator agree. On the first
+    # difference the last context commands are listed with it.
+    if (out_file is None):
+        out_file = sys.stdout
+    history = collections.deque(maxlen=context)
+    commands = 0
+    started = False
+
+    def report(what):
+        print("First difference at command", commands, "word time", g15.wt, file=out_file)
+        for [n, wt, line, l, word] in history:
+            print("  {:9d} {:11d} ".format(n, wt) + cosim_where(line, l) + ": " +
+                  command_to_pprasm(word) + "   # " + command_to_semantics(word, l), file=out_file)
+        print("  " + what, file=out_file)
+        return False
+
+    for record in records:
+        if (record[0] == "RC"):
+            [kind, line_name, addr, word] = record
+            if (started):
+                g15.step()
+                if (g15.halted or g15.wt >= max_wt):
+                    return report("Emulator stopped: " + (g15.stop_reason if g15.halted else "word time limit"))
+            else:
+                # Start the emulator at the first command of the log
+                if (line_name != "AR" and int(line_name[1:]) in cl_line):
+                    g15.cd = cl_line.index(int(line_name[1:]))
+                    if (addr is not None):
+                        g15.n = addr
+                started = True
+            commands += 1
+            [line, l, emu_word] = g15.next_command()
+            history.append([commands, g15.wt, line, l, emu_word])
+            where = cosim_where(line, l)
+            if (line_name == "AR"):
+                hdl_where = "AR"
+                where = "AR" if (line == 28) else where
+            else:
+                hdl_where = line_name + ("[" + bin_to_dstr(addr) + "]" if (addr is not None) else "")
+                if (addr is None):
+                    where = where[:where.index("[")]
+            if (hdl_where != where):
+                return report("Command address: HDL " + hdl_where + " emulator " + where)
+            if (word != emu_word):
+                return report("Command at " + where + ": HDL " + command_to_pprasm(word).strip() +
+                              " emulator " + command_to_pprasm(emu_word).strip())
+        elif (record[0] in cosim_dumps):
+            [name, words] = record
+            [line, size] = cosim_dumps[name]
+            for i in range(min(size, len(words))):
+                emu = g15.ar if (line == 28) else g15.m[line][i]
+                if (words[i] != emu):
+                    return report(name + "[" + bin_to_dstr(i) + "]: HDL " + word29_to_str(words[i]).strip() +
+                                  " emulator " + word29_to_str(emu).strip())
+    print("No differences in", commands, "commands, word time", g15.wt, file=out_file)
+    return True
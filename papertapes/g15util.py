@@ -5,15 +5,36 @@
 #   g15util.py cmd [args]
 
 # Commands:
-#   g15util.py asm <input file>
+#   g15util.py asm [-m] <input file>
 #   g15util.py dis <input file>
-#   g15util.py cvt -t "pt" | "pti" <input file>
+#   g15util.py cost [-e word] <input file>
+#   g15util.py cvt -t "pt" | "pti" | "mem" | "g15b" <input file>
+#   g15util.py run [-l line] [-e line:word] [-m word_times] [-t tape] [-b] [-p] [-s snapshot] [-r | --resume snapshot] [-o | --punch pt file] [-L | --log output log] <input file>
+#   g15util.py drum [-f "v" | "memb"] [-i instance] [-o output] [-n] <line>:<input file> ...
+#   g15util.py regress [-j jobs] [-m word_times] [-o summary file] [-r | --resume snapshot] <directory | .asm files>
+#   g15util.py build [-j jobs] [-m] [-f] <directory | .asm files>
+#   g15util.py trace [-c clock] [-w word sync] [-r drum sync] [-s signal,...] [-d] [-n words] <.vcd | $display log>
+#   g15util.py cosim [-l line:file ...] [-t tape] [-r snapshot] [-c context] [-m word_times] <$display log>
+#   g15util.py sweep [-l line] [-e line:word] [-m word_times] [-r AR | line:word] [-o output] <input file> <values file>
 
 import sys
 import os
 import getopt
 import json
 import datetime
+import struct
+import mmap
+import re
+import io
+import multiprocessing
+import hashlib
+import itertools
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional: the batch checksum falls back to checksum()
+    np = None
 
 digit_0_z = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9',
              'u', 'v', 'w', 'x', 'y', 'z']
@@ -28,6 +49,37 @@ for ch in pt_codes:
     if (ch != '?'):
         rev_pt_codes[ord(ch)] = pt_codes.index(ch)
 
+# Word codec tables. G-15 hexadecimal writes the digits 10-15 as u-z, so
+# words and quads convert with str.translate and int(..., 16)/format().
+g15_to_hex = str.maketrans("uvwxyz", "abcdef")
+hex_to_g15 = str.maketrans("abcdef", "uvwxyz")
+g15_digits = frozenset(digit_0_z)
+# Two-character word addresses 00-z9 and their values
+dstr_table = [digit_0_z[d // 10] + digit_0_9[d % 10] for d in range(160)]
+dstr_values = {dstr_table[d]: d for d in range(160)}
+# Block data is decoded from a common form: hex digits, the sign '-', the
+# reload '/' and stop 'S' codes, blanks, and '!' for anything else
+def quad_decode_table(codes):
+    table = 256 * ['!']
+    for code in range(len(codes)):
+        ch = codes[code]
+        if (ch in g15_digits):
+            table[code] = ch.translate(g15_to_hex)
+        elif (ch in "-/S "):
+            table[code] = ch
+    return bytes.maketrans(bytes(range(256)), "".join(table).encode())
+# Paper tape byte, PTI text and JSON data (R is the reload code) decoders
+pt_decode = quad_decode_table(pt_codes)
+pti_decode = quad_decode_table([chr(c) for c in range(256)])
+json_decode = quad_decode_table([chr(c) if (chr(c) != "R") else "/" for c in range(256)])
+# Character to paper tape byte for punching quads
+pt_encode = bytes.maketrans(bytes([ord(ch) for ch in pt_codes if (ch != '?')]),
+                            bytes([rev_pt_codes[ord(ch)] for ch in pt_codes if (ch != '?')]))
+# Bytes read from a paper tape at a time
+PT_CHUNK_SIZE = 1 << 20
+# Paper tape buffer of hdl/sim/tape_reader.sv (B = 2^14 bytes)
+MEM_SEGMENT_SIZE = 16384
+
 # Transfer type decoded from {((S > 27) | (D > 27)), CH}:
 tr_type = ["TR", "AD", "TVA", "AVA", "TR", "AD", "AV", "SU"]
 # Source register names:
@@ -61,17 +113,10 @@ def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
     
 def word29_to_str(word):
-    if (word & 0x1 != 0):
-        strout = "-."
-    else:
-        strout = " ."
-    word >>= 1
-    for i in range(7):
-        strout += digit_0_z[word >> (4 * (6 - i)) & 0xf]
-    return strout
+    return ("-." if (word & 0x1 != 0) else " .") + format((word >> 1) & 0xfffffff, "07x").translate(hex_to_g15)
 
 def bin_to_dstr(d):
-    return digit_0_z[d // 10] + digit_0_9[d % 10]
+    return dstr_table[d]
 
 def bin_to_dstr1(d):
     return digit_0_9[d % 10]
@@ -81,9 +126,9 @@ def dstr_to_bin(s):
         raise ValueError("Invalid length of dstr: " + s)
     if (len(s) == 1):
         s = "0" + s
-    if ((s[0] not in digit_0_z) or (s[1] not in digit_0_9)):
+    if (s not in dstr_values):
         raise ValueError("Invalid character in dstr: " + s)
-    return (digit_0_z.index(s[0]) * 10 + digit_0_9.index(s[1]))
+    return dstr_values[s]
 
 def add_29(a, b):
     # G-15 29-bit signed-magnitude arithmetic. Because of its bit-serial
@@ -106,6 +151,41 @@ def checksum(block):
         sum = add_29(sum, word)
     return sum
 
+def blocks_to_array(blocks):
+    # (n_blocks x 108) uint32 array of blocks. Short blocks are padded with
+    # zero words, which leave a checksum unchanged.
+    words = np.zeros((len(blocks), 108), dtype=np.uint32)
+    for i in range(len(blocks)):
+        block = blocks[i].buffer() if isinstance(blocks[i], Block) else blocks[i]
+        words[i, :len(block)] = block
+    return words
+
+def add_29_batch(a, b):
+    # add_29 applied element by element to two uint32 arrays
+    a = a.astype(np.int64) & 0x1fffffff
+    b = b.astype(np.int64) & 0x1fffffff
+    a = ((a & 0x1) << 28) | (a >> 1)
+    sum = np.where(b & 0x1 == 0, a + (b >> 1), a - (b >> 1)) & 0x1fffffff
+    sum = np.where(sum == 0x10000000, 0, sum)
+    return ((sum << 1 | sum >> 28) & 0x1fffffff).astype(np.uint32)
+
+def checksum_batch(blocks):
+    # Checksums of many blocks at once. blocks is an (n_blocks x 108)
+    # uint32 array or a list of blocks. The sum is kept with the sign in
+    # bit 28 (see add_29) and the words are added one column at a time
+    # across all blocks. checksum() remains the reference.
+    if np is None:
+        return [checksum(block) for block in blocks]
+    if not isinstance(blocks, np.ndarray):
+        blocks = blocks_to_array(blocks)
+    words = blocks.astype(np.int64) & 0x1fffffff
+    mags = np.where(words & 0x1 == 0, words >> 1, -(words >> 1))
+    sum = np.zeros(words.shape[0], dtype=np.int64)
+    for i in range(words.shape[1]):
+        sum = (sum + mags[:, i]) & 0x1fffffff
+        sum[sum == 0x10000000] = 0
+    return ((sum << 1 | sum >> 28) & 0x1fffffff).astype(np.uint32)
+
 def balance_checksum(target_sum, actual_sum):
     # Given a target checksum and an actual checksum, returns an
     # adjustment factor that when added to the actual checksum will
@@ -131,19 +211,149 @@ def balance_checksum(target_sum, actual_sum):
             return (~(t_mag - a_mag) + 1) << 1 | 0x1
 
 def str_to_word29(s):
+    digits = s.replace(".", "")
     sign = 0
-    word = 0
-    for ch in s:
-        if (ch == '.'):
-            continue
-        elif (ch == '-'):
-            sign = 1
-        elif (ch in digit_0_z):
-            word = (word << 4) | digit_0_z.index(ch)
-        else:
+    if ("-" in digits):
+        sign = 1
+        digits = digits.replace("-", "")
+    for ch in digits:
+        if (ch not in g15_digits):
             raise ValueError("Invalid character in word29: " + ch)
+    word = int(digits.translate(g15_to_hex), 16) if (digits != "") else 0
     return (word << 1) | sign
 
+# -----------------------------------------------------------------------------
+# Block storage. A Block holds up to 108 words in an array('I'). Bit i of
+# valid is set for every word that was read or assembled, kinds tags each
+# word 'A' (command) or 'C' (constant) for the listings (None: all
+# commands), and order lists the word addresses of an assembled block in
+# source order. Indexes and slices work as for the list of words a Block
+# replaces, except that a Block keeps its size: a slice read is a list and
+# a slice assignment must match the slice's length. The words may also be
+# a memoryview, e.g. of a mapped .g15b file; buffer() gives
+# the words to anything that takes a buffer. The block readers return an
+# empty Block at the end of a tape or for a block that is not there.
+# -----------------------------------------------------------------------------
+class Block:
+    __slots__ = ("words", "valid", "kinds", "order")
+
+    def __init__(self, words=(), valid=None, kinds=None, order=None):
+        self.words = words if isinstance(words, (array, memoryview)) else array("I", words)
+        self.valid = valid if (valid is not None) else (1 << len(self.words)) - 1
+        self.kinds = kinds
+        self.order = order
+
+    @classmethod
+    def unused(cls, size=108):
+        # A block of zero words, none of them valid yet
+        return cls(array("I", [0]) * size, 0, bytearray(b"A" * size), [])
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return list(self.words[key])
+        return self.words[key]
+
+    def __setitem__(self, key, word):
+        if isinstance(key, slice):
+            addrs = range(*key.indices(len(self.words)))
+            words = list(word)
+            if (len(words) != len(addrs)):
+                raise ValueError("Block slice assignment cannot change its size")
+            for i in range(len(addrs)):
+                self[addrs[i]] = words[i]
+            return
+        if (key < 0):
+            key += len(self.words)
+        if (key < 0 or key >= len(self.words)):
+            raise IndexError("Block index out of range")
+        self.words[key] = word
+        self.valid |= 1 << key
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __eq__(self, other):
+        if isinstance(other, Block):
+            other = other.words
+        return len(self.words) == len(other) and all(a == b for a, b in zip(self.words, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Block(" + str(self.words.tolist()) + ")"
+
+    def buffer(self):
+        # Block does not implement the buffer protocol itself (__buffer__
+        # needs Python 3.12)
+        return memoryview(self.words)
+
+    def is_valid(self, addr):
+        return (self.valid >> addr) & 0x1 == 1
+
+    def kind(self, addr):
+        return chr(self.kinds[addr]) if (self.kinds is not None) else 'A'
+
+    def set_word(self, addr, word, kind):
+        # Store an assembled word and record its kind and source order
+        self[addr] = word
+        self.kinds[addr] = ord(kind)
+        self.order.append(addr)
+
+def quad_to_str(quad_data, stop):
+    # Sign, 29 digits and the stop (S) or reload (/) code of a quad
+    return (("-" if quad_data & 0x1 else " ") +
+            format(quad_data, "029x").translate(hex_to_g15) + ("S" if stop else "/"))
+
+def block_to_quads(block):
+    # Quads of a block in punching order, from its last word down
+    quads = []
+    quad_data = 0
+    for block_idx in range(len(block)-1, -1, -1):
+        quad_data = (quad_data << 29) | (block[block_idx] & 0x1fffffff)
+        if (block_idx % 4 == 0):
+            quads.append(quad_to_str(quad_data, block_idx == 0))
+            quad_data = 0
+    return quads
+
+def quads_to_block(text):
+    # Decode one block from the common form (see quad_decode_table). Quads
+    # are terminated by '/' or 'S' and hold words 107 down to 0.
+    block = array("I", [0]) * 108
+    block_idx = 107
+    if ("!" in text):
+        eprint("Error: Invalid characters in block data:", text.count("!"))
+        text = text.replace("!", "")
+    quads = text.split("/")
+    if (quads[-1].endswith("S")):
+        quads[-1] = quads[-1][:-1]
+    else:
+        # Digits after the last reload code do not make a quad
+        quads = quads[:-1]
+    for quad in quads:
+        digits = quad.replace(" ", "").replace("-", "")
+        if (len(digits) != 29):
+            eprint("Error: Invalid number of digits in quad data", len(digits), block_idx)
+        if (block_idx < 0):
+            eprint("Error: Block data overflow (> 108 words)")
+            continue
+        quad_data = int(digits, 16) if (digits != "") else 0
+        for i in range(4):
+            block[block_idx-3+i] = quad_data & 0x1fffffff
+            quad_data >>= 29
+        block_idx -= 4
+
+    if block_idx == 107:
+        return Block()
+
+    # A short block (< 108 words) is shifted to origin 0 and truncated
+    if (block_idx != -1):
+        block = block[block_idx+1:]
+
+    return Block(block)
+
 def strip_comments_whitespace(line):
     line = line.split("#")[0]
     line = "".join(line.split())
@@ -151,31 +361,18 @@ def strip_comments_whitespace(line):
 
 def print_pti_block(block, pti_file):
     print("# PTI block data:", file=pti_file)
-    quad_data = 0
-    minus = False
-    for block_idx in range(len(block)-1, -1, -1):
-        quad_data = (quad_data << 29) | (block[block_idx] & 0x1fffffff)
-        if (block_idx % 4 == 0):
-            quad_str = "-" if quad_data & 0x1 else " "
-            for i in range(29):
-                quad_str = quad_str + digit_0_z[(quad_data >> ((28 - i) * 4)) & 0xf]
-            quad_str = quad_str + "S" if block_idx == 0 else quad_str + "/"
-            print(quad_str, file=pti_file)
-            quad_data = 0
+    for quad_str in block_to_quads(block):
+        print(quad_str, file=pti_file)
 
 
 def seek_pti_block(pti_file, block_no):
-    block_pos = 0
-    pti_file.seek(0)
-    for line in pti_file:
-        if (block_pos == block_no):
-            return True
-        line = strip_comments_whitespace(line)
-        if (line == ""):
-            continue
-        if (line.find("S") > 0):
-            block_pos += 1
-    return (block_pos == block_no)
+    # Position pti_file at the start of block block_no using the block
+    # offset index (see block_index)
+    spans = block_index(pti_file.name)
+    if (block_no < 0 or block_no > len(spans)):
+        return False
+    pti_file.seek(spans[block_no][0] if (block_no < len(spans)) else os.path.getsize(pti_file.name))
+    return True
 
 def read_pti_block(pti_file):
     pti_block = ""
@@ -187,241 +384,409 @@ def read_pti_block(pti_file):
         if (line.find("S") > 0):
             break
     if pti_block == "":
-        return []
-
-    block = 108 * [0x00000000]
-    block_idx = 107
-    quad_data = 0
-    quad_digits = 0
-    minus = False
-    for raw_char in pti_block:
-        match raw_char:
-            case '0' | '1' | '2' | '3' | '4' | '5' | '6' | '7' | '8' | '9':
-                # convert character to 4-bit integer and insert into quad
-                quad_data = (quad_data << 4) | (ord(raw_char) - ord('0'))
-                quad_digits += 1
-            case 'u' | 'v' | 'w' | 'x' | 'y' | 'z':
-                quad_data = (quad_data << 4) | (ord(raw_char) - ord('u') + 10)
-                quad_digits += 1
-            case '-':
-                minus = True
-            case 'S' | '/':
-                if (quad_digits != 29):
-                    eprint("Error: Invalid number of digits in quad data", quad_digits, block_idx)
-                if (block_idx < 0):
-                    eprint("Error: Block data overflow (> 108 words)")
-                else:
-                    for i in range(4):
-                        block[block_idx-3+i] = quad_data & 0x1fffffff
-                        quad_data >>= 29
-                    block_idx -= 4
-                quad_data = 0
-                quad_digits = 0
-                minus = False
-            case _:
-                eprint("Error: Invalid character in block data:", raw_char)
-
-    # A short block (< 108 words) is shifted to origin 0 and truncated
-    if (block_idx != -1):
-        short_block_size = 107 - block_idx
-        for i in range(short_block_size):
-            block[i] = block[i+block_idx+1]
-        block = block[:short_block_size]
-
-    return block
+        return Block()
+    return quads_to_block(pti_block.encode("latin-1", "replace").translate(pti_decode).decode("ascii"))
 
 def read_pti_file(pti_file):
     blocks = []
     while True:
         block = read_pti_block(pti_file)
-        if block == []:
+        if len(block) == 0:
             break
         blocks.append(block)
     return blocks
 
 def print_pt_block(block, pt_file):
-    quad_data = 0
-    minus = False
-    for block_idx in range(len(block)-1, -1, -1):
-        quad_data = (quad_data << 29) | (block[block_idx] & 0x1fffffff)
-        if (block_idx % 4 == 0):
-            quad_str = "-" if quad_data & 0x1 else " "
-            for i in range(29):
-                quad_str = quad_str + digit_0_z[(quad_data >> ((28 - i) * 4)) & 0xf]
-            quad_str = quad_str + "S" if block_idx == 0 else quad_str + "/"
-            for ch in quad_str:
-                pt_file.write(bytes([rev_pt_codes[ord(ch)]]))
-            quad_data = 0
-
-def read_pt_block(pt_file):
-    block = 108 * [0x00000000]
-    block_idx = 107
-    quad_data = 0
-    quad_digits = 0
-    minus = False
-    while (bin_char := pt_file.read(1)):
-        bin_char = ord(bin_char)
-        if (bin_char > 31):
-            eprint("Error: Invalid character in PT block1:", bin_char)
-            continue
-        pt_char = pt_codes[bin_char]
-        if (pt_char == '?'):
-            eprint("Error: Invalid character in PT block2:", bin_char)
-            continue
-        match pt_char:
-            case '0' | '1' | '2' | '3' | '4' | '5' | '6' | '7' | '8' | '9':
-                # convert character to 4-bit integer and insert into quad
-                quad_data = (quad_data << 4) | (ord(pt_char) - ord('0'))
-                quad_digits += 1
-            case 'u' | 'v' | 'w' | 'x' | 'y' | 'z':
-                quad_data = (quad_data << 4) | (ord(pt_char) - ord('u') + 10)
-                quad_digits += 1
-            case '-':
-                minus = True
-            case 'S' | '/':
-                if (quad_digits != 29):
-                    eprint("Error: Invalid number of digits in quad data", quad_digits, block_idx)
-                if (block_idx < 0):
-                    eprint("Error: Block data overflow (> 108 words)")
-                else:
-                    for i in range(4):
-                        block[block_idx-3+i] = quad_data & 0x1fffffff
-                        quad_data >>= 29
-                    block_idx -= 4
-                quad_data = 0
-                quad_digits = 0
-                minus = False
-                if (pt_char == 'S'):
-                    break
-            case ' ':
-                #if block_idx != 107 or quad_digits != 0:
-                    #print("Extraneous space in block:", block_idx, quad_digits)
-                continue
-            case _:
-                eprint("Error: Invalid character in PT block3:", pt_char)
+    pt_file.write("".join(block_to_quads(block)).encode().translate(pt_encode))
 
-    if block_idx == 107:
-        return []
+def iter_pt_file(pt_file):
+    # Yield the blocks of an open binary paper tape file one at a time. The
+    # tape is read in large chunks and translated with pt_decode.
+    pending = ""
+    while (chunk := pt_file.read(PT_CHUNK_SIZE)):
+        pending += chunk.translate(pt_decode).decode("ascii")
+        start = 0
+        while ((stop := pending.find("S", start)) >= 0):
+            block = quads_to_block(pending[start:stop+1])
+            if len(block) != 0:
+                yield block
+            start = stop + 1
+        pending = pending[start:]
+    block = quads_to_block(pending)
+    if len(block) != 0:
+        yield block
 
-    # A short block (< 108 words) is shifted to origin 0 and truncated
-    if (block_idx != -1):
-        short_block_size = 107 - block_idx
-        for i in range(short_block_size):
-            block[i] = block[i+block_idx+1]
-        block = block[:short_block_size]
-
-    return block
+def iter_pt_blocks(path):
+    # Yield the blocks of the paper tape file at path
+    with open(path, "rb") as pt_file:
+        yield from iter_pt_file(pt_file)
 
 def read_pt_file(pt_file):
-    blocks = []
-    while True:
-        block = read_pt_block(pt_file)
-        if block == []:
-            break
-        blocks.append(block)
-    return blocks
+    return list(iter_pt_file(pt_file))
 
 def read_json_block(json_block):
-    # fill block_data array with value indicating undefined for debug
-    block = 108 * [0xf0000000]
-    block_idx = 107
-    quad_data = 0
-    quad_digits = 0
-    minus = False
-
-    # iterate over data string one character at a time
-    for json_char in json_block["data"]:
-        match json_char:
-            case '0' | '1' | '2' | '3' | '4' | '5' | '6' | '7' | '8' | '9':
-                # convert character to 4-bit integer and insert into quad
-                quad_data = (quad_data << 4) | (ord(json_char) - ord('0'))
-                quad_digits += 1
-            case 'u' | 'v' | 'w' | 'x' | 'y' | 'z':
-                quad_data = (quad_data << 4) | (ord(json_char) - ord('u') + 10)
-                quad_digits += 1
-            case '-':
-                minus = True
-            case 'S' | 'R':
-                if (quad_digits != 29):
-                    eprint("Error: Invalid number of digits in quad data", quad_digits, block_idx)
-                if (block_idx < 0):
-                    eprint("Error: Block data overflow (> 108 words)")
-                else:
-                    for i in range(4):
-                        block[block_idx-3+i] = quad_data & 0x1fffffff
-                        quad_data >>= 29
-                    block_idx -= 4
-                quad_data = 0
-                quad_digits = 0
-                minus = False
-            case _:
-                eprint("Error: Invalid character in block data:", json_char)
+    return quads_to_block(json_block["data"].encode("latin-1", "replace").translate(json_decode).decode("ascii"))
 
-    # A short block (< 108 words) is shifted to origin 0 and truncated
-    if (block_idx != -1):
-        short_block_size = 107 - block_idx
-        for i in range(short_block_size):
-            block[i] = block[i+block_idx+1]
-        block = block[:short_block_size]
-    return block
+def iter_json_entries(json_file):
+    # Yield [entry, start, end] for each element of the "entries" array of a
+    # JSON tape dump, parsing it a chunk at a time. start and end are
+    # character positions, which are byte offsets for a file opened in
+    # binary mode (read as latin-1).
+    decoder = json.JSONDecoder()
+    separator = re.compile(r"[\s,]*")
+    text = ""
+    base = 0
+    pos = -1
+    eof = False
+
+    def more():
+        chunk = json_file.read(PT_CHUNK_SIZE)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode("latin-1")
+        return chunk
+
+    # Find the "entries" key of the top-level object. Strings are skipped
+    # whole and brackets counted, so an "entries" nested deeper or inside a
+    # string is not taken for it.
+    scanner = re.compile(r'"(?:[^"\\]|\\.)*(")?|[\[\]{}]')
+    array_start = re.compile(r"\s*:\s*\[")
+    partial_start = re.compile(r"\s*(?::\s*)?\Z")
+    depth = 0
+    i = 0
+    while (pos < 0):
+        m = scanner.search(text, i)
+        wait = (m is None or (m.group()[0] == '"' and m.group(1) is None))
+        if (not wait):
+            token = m.group()
+            if (token in ("{", "[")):
+                depth += 1
+            elif (token in ("}", "]")):
+                depth -= 1
+            elif (depth == 1 and token == '"entries"'):
+                start = array_start.match(text, m.end())
+                if (start is not None):
+                    pos = start.end() - 1
+                wait = (start is None and partial_start.match(text, m.end()) is not None)
+        if (wait):
+            # The text read so far ends with nothing left to scan, within a
+            # string or just after the key: scanning resumes there
+            i = len(text) if (m is None) else m.start()
+            chunk = more()
+            if (chunk == ""):
+                raise ValueError("No entries array")
+            text += chunk
+        else:
+            i = m.end()
+    pos += 1
+    while True:
+        pos = separator.match(text, pos).end()
+        if (pos < len(text) and text[pos] == "]"):
+            return
+        try:
+            if (pos >= len(text)):
+                raise json.JSONDecodeError("Truncated entries array", text, pos)
+            [entry, end] = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            # The entry runs past the text read so far
+            if (eof):
+                raise
+            chunk = more()
+            eof = chunk == ""
+            text = text[pos:] + chunk
+            base += pos
+            pos = 0
+            continue
+        yield [entry, base + pos, base + end]
+        pos = end
+
+def select_json_entries(json_file, log_file=None):
+    # A tape block may have been read several times. Keeps the entry with
+    # the fewest errors for each tape block, the first one read on a tie.
+    # Returns the map of tape block numbers to entry indexes and the
+    # selected [entry, entry index, start, end] for each block in block
+    # number order. Each entry read is listed on log_file if given.
+    block_map = []
+    best = []
+    entry_idx = 0
+    for [entry, start, end] in iter_json_entries(json_file):
+        block_num = entry["blocknum"]
+        if (block_num >= len(block_map)):
+            block_map.extend([] for i in range(block_num + 1 - len(block_map)))
+            best.extend(None for i in range(block_num + 1 - len(best)))
+        block_map[block_num].append(entry_idx)
+        if (log_file is not None):
+            print("Index:", entry_idx, "Block:", block_num, "Errors:", entry["nerrors"], "Checksum:", entry["checksum"], file=log_file)
+        if (best[block_num] is None or entry["nerrors"] < best[block_num][0]["nerrors"]):
+            best[block_num] = [entry, entry_idx, start, end]
+        entry_idx += 1
+    selected = []
+    for block_num in range(len(best)):
+        if (best[block_num] is None):
+            if (block_num != 0):
+                eprint("Error: Missing block in JSON file:", block_num)
+            continue
+        if (best[block_num][0]["nerrors"] > 0):
+            eprint("Warning: Block", block_num, "has errors:", best[block_num][0]["nerrors"])
+        selected.append(best[block_num])
+    return [block_map, selected]
 
 def read_json_file(json_file):
+    # Only the selected entry of each tape block is kept and decoded
     try:
-        json_db = json.load(json_file)
-    except:
+        [block_map, selected] = select_json_entries(json_file, sys.stdout)
+    except (ValueError, KeyError, TypeError):
         eprint("Error: Invalid JSON file format")
         return []
 
-    all_blocks = []
-    block_idx = 0
-    for json_block in json_db["entries"]:
-        block_num = json_block["blocknum"]
-        block_errs = json_block["nerrors"]
-        block_checksum = json_block["checksum"]
-        block = read_json_block(json_block)
-        all_blocks.append(block)
-        calc_checksum = word29_to_str(checksum(block))
-        print("Index:", block_idx, "Block:", block_num, "Len:", len(block), "Errors:", block_errs, "Checksum:", block_checksum, "Calc:", calc_checksum)
-        block_idx += 1
-
-    # find block number range in json_block
-    block_num_max = 0
-    for json_block in json_db["entries"]:
-        block_num = json_block["blocknum"]
-        if block_num > block_num_max:
-            block_num_max = block_num
-    # create 1 to many map of tape block numbers to index into json_db["entries"]
-    block_map = [[] for i in range(block_num_max + 1)]
-    #print("Block map:", block_map)
-    entry_idx = 0
-    for json_block in json_db["entries"]:
-        block_num = json_block["blocknum"]
-        block_map[block_num].append(entry_idx)
-        #print("Block:", block_num, "Entry:", entry_idx, "Map:", block_map)
-        entry_idx += 1
-    # select one json_db["entries"] block for each tape block
-    blocks = []
-    map_idx = 0
     print("Block map:", block_map)
-    for map in block_map:
-        if len(map) == 0:
-            if map_idx != 0:
-                eprint("Error: Missing block in JSON file:", map_idx)
+    blocks = []
+    for [entry, entry_idx, start, end] in selected:
+        block = read_json_block(entry)
+        print("Block:", entry["blocknum"], "Index:", entry_idx, "Len:", len(block), "Checksum:", entry["checksum"], "Calc:", word29_to_str(checksum(block)))
+        blocks.append(block)
+
+    return blocks
+
+# -----------------------------------------------------------------------------
+# Block offset index. The sidecar file <tape>.idx records the byte span of
+# every block of a .pti, .pt or .json tape so that one block can be read
+# without decoding the others. The index is rebuilt when the size or
+# modification time of the tape no longer match.
+# -----------------------------------------------------------------------------
+INDEX_VERSION = 1
+
+def index_pti_file(pti_file):
+    # Blocks end with the line holding the stop code
+    spans = []
+    start = 0
+    pos = 0
+    data = False
+    for line in pti_file:
+        pos += len(line)
+        line = strip_comments_whitespace(line.decode("ascii", "replace"))
+        if (line == ""):
             continue
-        min_errs = 99999
-        sel_entry_idx = 0
-        for entry_idx in map:
-            entry = json_db["entries"][entry_idx]
-            if entry["nerrors"] < min_errs:
-                min_errs = entry["nerrors"]
-                sel_entry_idx = entry_idx
-        if json_db["entries"][sel_entry_idx]["nerrors"] > 0:
-            eprint("Warning: Block", map_idx, "has errors:", json_db["entries"][sel_entry_idx]["nerrors"])
-        blocks.append(read_json_block(json_db["entries"][sel_entry_idx]))
-        map_idx += 1
+        data = True
+        if (line.find("S") > 0):
+            spans.append([start, pos])
+            start = pos
+            data = False
+    if (data):
+        spans.append([start, pos])
+    return spans
+
+def index_pt_file(pt_file):
+    # Blocks end with the stop code; quads ended by reload codes after the
+    # last stop code make a final short block (see iter_pt_file)
+    spans = []
+    start = 0
+    pos = 0
+    stop_code = bytes([rev_pt_codes[ord("S")]])
+    reload_code = bytes([rev_pt_codes[ord("/")]])
+    while (chunk := pt_file.read(PT_CHUNK_SIZE)):
+        i = 0
+        while ((i := chunk.find(stop_code, i)) >= 0):
+            i += 1
+            spans.append([start, pos + i])
+            start = pos + i
+        pos += len(chunk)
+    pt_file.seek(start)
+    if (pt_file.read().find(reload_code) >= 0):
+        spans.append([start, pos])
+    return spans
+
+def index_json_file(json_file):
+    # Spans of the entries read_json_file selects
+    [block_map, selected] = select_json_entries(json_file)
+    return [[start, end] for [entry, entry_idx, start, end] in selected]
+
+def load_block_index(idx_fn, st):
+    # The spans of a sidecar index that matches the tape with status st, or
+    # None when the index is missing, stale or corrupt
+    try:
+        with open(idx_fn) as idx_file:
+            idx = json.load(idx_file)
+        if (idx["version"] != INDEX_VERSION or idx["size"] != st.st_size or
+            idx["mtime_ns"] != st.st_mtime_ns):
+            return None
+        spans = idx["spans"]
+        end = 0
+        for [span_start, span_end] in spans:
+            if (not isinstance(span_start, int) or not isinstance(span_end, int) or
+                span_start < end or span_end < span_start or span_end > st.st_size):
+                return None
+            end = span_end
+        return spans
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def block_index(fn, rebuild=False):
+    # Returns the [start, end] byte spans of the blocks of a tape file,
+    # creating or refreshing its sidecar index
+    try:
+        st = os.stat(fn)
+    except OSError:
+        eprint("Error: Input file not found:", fn)
+        sys.exit(1)
+    idx_fn = fn + ".idx"
+    if not rebuild:
+        spans = load_block_index(idx_fn, st)
+        if spans is not None:
+            return spans
+    fname, fext = os.path.splitext(fn)
+    tape_file = open_input_file(fn, "rb")
+    if fext == ".pti":
+        spans = index_pti_file(tape_file)
+    elif fext == ".pt":
+        spans = index_pt_file(tape_file)
+    else:
+        try:
+            spans = index_json_file(tape_file)
+        except (ValueError, KeyError, TypeError):
+            eprint("Error: Invalid JSON file format")
+            sys.exit(1)
+    tape_file.close()
+    idx = {"version": INDEX_VERSION, "size": st.st_size,
+           "mtime_ns": st.st_mtime_ns, "spans": spans}
+    try:
+        with open(idx_fn, "w") as idx_file:
+            json.dump(idx, idx_file)
+    except OSError:
+        # Without a writable sidecar the tape is simply rescanned next time
+        pass
+    return spans
+
+def read_tape_block(fn, block_no):
+    # Decode only block block_no of a .pti, .pt or .json tape. A .g15b
+    # file has its own directory.
+    if fn.endswith(".g15b"):
+        [mm, directory, provenance, words_offset] = open_g15b_file(fn)
+        if (block_no < 0 or block_no >= len(directory)):
+            return Block()
+        block = g15b_block(mm, directory, words_offset, block_no)
+        check_g15b_checksums(fn, directory, [checksum(block)], block_no)
+        return block
+    fname, fext = os.path.splitext(fn)
+    for rebuild in (False, True):
+        spans = block_index(fn, rebuild)
+        if (block_no < 0 or block_no >= len(spans)):
+            return Block()
+        [start, end] = spans[block_no]
+        tape_file = open_input_file(fn, "rb")
+        tape_file.seek(start)
+        data = tape_file.read(end - start)
+        tape_file.close()
+        if fext == ".pti":
+            return read_pti_block(io.StringIO(data.decode("ascii", "replace")))
+        if fext == ".pt":
+            return quads_to_block(data.translate(pt_decode).decode("ascii"))
+        try:
+            return read_json_block(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            # The span is not an entry: the index is rebuilt and tried again
+            pass
+    eprint("Error: Invalid JSON file format")
+    sys.exit(1)
 
+# -----------------------------------------------------------------------------
+# .g15b binary tape container
+#   header      G15B_HEADER: magic, version, block count and the offsets of
+#               the directory, the provenance and the words
+#   directory   G15B_ENTRY per block: length in words, flags (0) and the
+#               block checksum
+#   provenance  UTF-8 JSON: source file and format, creation time, tool
+#   words       108 little-endian 32-bit slots per block, each holding a
+#               29-bit word. The slots past the end of a short block are 0.
+# The file is mapped with mmap and the words are used in place, as
+# memoryviews in Blocks or as an (n_blocks x 108) NumPy array. The
+# checksums in the directory are verified whenever blocks are read.
+# -----------------------------------------------------------------------------
+G15B_MAGIC = b"G15B"
+G15B_VERSION = 1
+G15B_HEADER = struct.Struct("<4sHHIIIII")
+G15B_ENTRY = struct.Struct("<HHI")
+
+def write_g15b_file(blocks, g15b_file, provenance):
+    blocks = list(blocks)
+    prov = json.dumps(provenance).encode("utf-8")
+    dir_offset = G15B_HEADER.size
+    prov_offset = dir_offset + len(blocks) * G15B_ENTRY.size
+    words_offset = (prov_offset + len(prov) + 7) & ~7
+    g15b_file.write(G15B_HEADER.pack(G15B_MAGIC, G15B_VERSION, 0, len(blocks),
+                                     dir_offset, prov_offset, len(prov), words_offset))
+    for block in blocks:
+        g15b_file.write(G15B_ENTRY.pack(len(block), 0, checksum(block)))
+    g15b_file.write(prov)
+    g15b_file.write(bytes(words_offset - prov_offset - len(prov)))
+    for block in blocks:
+        words = array("I", [0]) * 108
+        for i in range(len(block)):
+            words[i] = block[i] & 0x1fffffff
+        if sys.byteorder != "little":
+            words.byteswap()
+        g15b_file.write(words.tobytes())
+
+def open_g15b_file(fn):
+    # Map a .g15b file. Returns [mapped file, directory, provenance, offset
+    # of the words].
+    g15b_file = open_input_file(fn, "rb")
+    try:
+        mm = mmap.mmap(g15b_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        mm = b""
+    g15b_file.close()
+    if len(mm) < G15B_HEADER.size:
+        eprint("Error: Invalid .g15b file:", fn)
+        sys.exit(1)
+    [magic, version, flags, count, dir_offset, prov_offset, prov_len,
+     words_offset] = G15B_HEADER.unpack_from(mm, 0)
+    if (magic != G15B_MAGIC or version != G15B_VERSION or
+        words_offset + 4 * 108 * count > len(mm)):
+        eprint("Error: Invalid .g15b file:", fn)
+        sys.exit(1)
+    directory = [list(G15B_ENTRY.unpack_from(mm, dir_offset + i * G15B_ENTRY.size))
+                 for i in range(count)]
+    if any(entry[0] > 108 for entry in directory):
+        eprint("Error: Invalid .g15b file:", fn)
+        sys.exit(1)
+    provenance = json.loads(bytes(mm[prov_offset:prov_offset + prov_len]).decode("utf-8"))
+    return [mm, directory, provenance, words_offset]
+
+def g15b_block(mm, directory, words_offset, block_no):
+    # Block block_no of a mapped .g15b file, without copying on
+    # little-endian hosts
+    start = words_offset + 4 * 108 * block_no
+    end = start + 4 * directory[block_no][0]
+    if sys.byteorder == "little":
+        return Block(memoryview(mm)[start:end].cast("I"))
+    words = array("I", mm[start:end])
+    words.byteswap()
+    return Block(words)
+
+def check_g15b_checksums(fn, directory, sums, first=0):
+    # Compare the checksums of blocks first, first + 1, ... with the
+    # directory
+    for i in range(len(sums)):
+        if (sums[i] != directory[first + i][2]):
+            eprint("Error: Checksum mismatch in .g15b file:", fn, "block", first + i)
+            sys.exit(1)
+
+def read_g15b_file(fn):
+    [mm, directory, provenance, words_offset] = open_g15b_file(fn)
+    blocks = [g15b_block(mm, directory, words_offset, block_no)
+              for block_no in range(len(directory))]
+    check_g15b_checksums(fn, directory, checksum_batch(blocks))
     return blocks
 
+def g15b_array(fn):
+    # (n_blocks x 108) NumPy view of the words of a .g15b file, usable
+    # directly with checksum_batch
+    [mm, directory, provenance, words_offset] = open_g15b_file(fn)
+    words = np.frombuffer(mm, dtype="<u4", count=108 * len(directory),
+                          offset=words_offset).reshape(len(directory), 108)
+    check_g15b_checksums(fn, directory, checksum_batch(words))
+    return words
+
 # -----------------------------------------------------------------------------
 # The mighty G-15 assembler
 # -----------------------------------------------------------------------------
@@ -504,8 +869,7 @@ def asm_line(fields):
     return [addr, data, is_asm]
 
 def assemble_file(asm_file):
-    block = 108 * [0xf0000000]
-    block_map = []
+    block = Block.unused()
     line_no = 0
     for line in asm_file:
         line_no += 1
@@ -520,13 +884,231 @@ def assemble_file(asm_file):
             continue
         [addr, data, is_asm] = asm_line(fields)
         if (addr != 0xffffffff):
-            if (block[addr] != 0xf0000000):
+            if (block.is_valid(addr)):
                 eprint("Duplicate address in asm file: " + line)
             else:
-                block[addr] = data
-                map_code = 'A' if is_asm else 'C'
-                block_map.append([map_code, addr])
-    return [block, block_map]
+                block.set_word(addr, data, 'A' if is_asm else 'C')
+    return block
+
+# -----------------------------------------------------------------------------
+# Multi-line assembler (asm -m). Source lines are:
+#   LL:WW: statement          statement at word WW of drum line LL
+#   label: LL:WW: statement   also defines label as LL:WW
+#   name = value              value is a number, a word constant or LL:WW
+# A statement is a command or a word constant as in a single block, or the
+# name of a word constant. In a command the T and N fields may name a
+# label (its word) or a number, the S and D fields a label (its line) or a
+# number. Symbols start with a letter or '_' and must not read as a
+# number (e.g. "u3"). Symbols are collected in the first pass and
+# resolved in the second, so they may be used before they are defined.
+# Each drum line used becomes one block of the tape, in line order.
+#
+# Placement: a statement at LL:* is placed by the assembler, and a
+# command's N field may be * for the next statement in the source (which
+# must be in the same line). Between the two passes the floating
+# statements are placed in source order, each at the first free word at
+# or after the word its predecessor finishes on (command_timing), so the
+# drum does not have to turn to reach it. The placement is greedy, one
+# statement at a time: it does not search for an optimum over the whole
+# program, place operands, or look at branch targets other than N. In an
+# immediate command or a special a T field of * asks for the shortest
+# timing, L+2; a deferred transfer's T is the address of its operand and
+# must be given. Fixed addresses are never moved, and a label on a
+# floating statement can only be used in a T field once it is placed. A
+# floating statement that follows a command with an N of * is not placed
+# when that command cannot be resolved, as it would land in a word the
+# command does not lead to.
+# -----------------------------------------------------------------------------
+asm_symbol_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*$")
+
+def is_asm_symbol(s):
+    return (asm_symbol_re.match(s) is not None and s not in dstr_values)
+
+def asm_line_word(s, floating=False):
+    # LL:WW as [line, word]. With floating LL:* gives [line, None].
+    fields = s.split(":")
+    if (len(fields) != 2):
+        raise ValueError("Invalid line:word address in asm: " + s)
+    try:
+        line = dstr_to_bin(fields[0])
+        if (floating and fields[1] == "*"):
+            return [line, None]
+        word = dstr_to_bin(fields[1])
+    except ValueError:
+        raise ValueError("Invalid line:word address in asm: " + s)
+    if (line > 19 or word > 107):
+        raise ValueError("Invalid line:word address in asm: " + s)
+    return [line, word]
+
+def asm_symbol_value(s):
+    # Symbol table entries are ['A', line, word] for addresses, ['N', n] for
+    # numbers and ['W', word] for word constants
+    if (s.count(":") == 1):
+        return ['A'] + asm_line_word(s)
+    if (s.count(".") == 1):
+        return ['W', str_to_word29(s)]
+    return ['N', dstr_to_bin(s)]
+
+def asm_resolve_field(field, symbols, use_line):
+    # A T, N, S or D field with any symbol replaced by its number
+    if (not is_asm_symbol(field)):
+        return field
+    if (field not in symbols):
+        raise ValueError("Undefined symbol in asm: " + field)
+    value = symbols[field]
+    if (value[0] == 'A'):
+        if (value[2] is None and not use_line):
+            raise ValueError("Floating label used before it is placed in asm: " + field)
+        return bin_to_dstr(value[1] if use_line else value[2])
+    if (value[0] == 'N'):
+        return bin_to_dstr(value[1])
+    raise ValueError("Word constant used as a field in asm: " + field)
+
+def asm_resolve(stmt, symbols, waddr=0, next_waddr=None):
+    # Returns [data, is_asm] for the statement at waddr, resolving symbols.
+    # next_waddr is the word of the next statement, for an N field of *.
+    if (is_asm_symbol(stmt)):
+        if (stmt not in symbols):
+            raise ValueError("Undefined symbol in asm: " + stmt)
+        if (symbols[stmt][0] != 'W'):
+            raise ValueError("Symbol is not a word constant in asm: " + stmt)
+        return [symbols[stmt][1], False]
+    if (stmt.count(".") == 1):
+        return [str_to_word29(stmt), False]
+    fields = stmt.split(".")
+    first = len(fields) - 5
+    if (first >= 0):
+        bp = ""
+        if (fields[-1].endswith("*")):
+            bp = "*"
+            fields[-1] = fields[-1][:-1]
+        if (fields[first] == "*"):
+            d = dstr_to_bin(asm_resolve_field(fields[-1], symbols, True))
+            if (d != 31 and (first == 0 or fields[0] != "u")):
+                raise ValueError("T of * in a deferred command in asm: " + stmt)
+            fields[first] = bin_to_dstr((waddr + 2) % 108)
+        if (fields[first + 1] == "*"):
+            if (next_waddr is None):
+                raise ValueError("No next statement in the line for N of * in asm: " + stmt)
+            fields[first + 1] = bin_to_dstr(next_waddr)
+        for i in range(first, len(fields)):
+            fields[i] = asm_resolve_field(fields[i], symbols, i - first >= 3)
+        fields[-1] += bp
+    return [str_asm_word29(".".join(fields)), True]
+
+def asm_next_is_flow(stmt):
+    # True for a command whose N field is *
+    fields = stmt.split(".")
+    return (len(fields) >= 5 and fields[len(fields) - 4] == "*")
+
+def assemble_multi_file(asm_file):
+    # Returns the [line, block] pairs of the program in line order and the
+    # symbol table
+    symbols = {}
+    stmts = []
+    # Pass 1: addresses and symbols
+    line_no = 0
+    for line in asm_file:
+        line_no += 1
+        wk_line = "".join(line.split("#")[0].split())
+        if (wk_line == ""):
+            continue
+        try:
+            if ("=" in wk_line):
+                [name, value] = wk_line.split("=", 1)
+                if (not is_asm_symbol(name)):
+                    raise ValueError("Invalid symbol in asm: " + name)
+                if (name in symbols):
+                    raise ValueError("Duplicate symbol in asm: " + name)
+                symbols[name] = asm_symbol_value(value)
+                continue
+            fields = wk_line.split(":")
+            name = None
+            if (len(fields) == 4):
+                name = fields[0]
+                fields = fields[1:]
+                if (not is_asm_symbol(name)):
+                    raise ValueError("Invalid symbol in asm: " + name)
+                if (name in symbols):
+                    raise ValueError("Duplicate symbol in asm: " + name)
+            elif (len(fields) != 3):
+                raise ValueError("Invalid number of fields in asm line: " + line.rstrip())
+            [addr_line, addr_word] = asm_line_word(fields[0] + ":" + fields[1], True)
+            if (name is not None):
+                symbols[name] = ['A', addr_line, addr_word]
+            stmts.append([addr_line, addr_word, fields[2], line, name])
+        except ValueError as e:
+            eprint(e)
+    # Greedy placement of the floating statements (see above)
+    used = {}
+    for [addr_line, addr_word, stmt, line, name] in stmts:
+        if (addr_word is not None):
+            if (addr_line not in used):
+                used[addr_line] = bytearray(108)
+            used[addr_line][addr_word] = 1
+    prev = None
+    for st in stmts:
+        [addr_line, addr_word, stmt, line, name] = st
+        if (addr_word is None):
+            if (addr_line not in used):
+                used[addr_line] = bytearray(108)
+            want = 0
+            if (prev is not None and prev[0] == addr_line and prev[1] is not None and
+                asm_next_is_flow(prev[2])):
+                try:
+                    [data, is_asm] = asm_resolve(prev[2], symbols, prev[1], 0)
+                    want = incr_waddr(command_timing(data, prev[1])[2])
+                except ValueError as e:
+                    # The error itself is reported in pass 2
+                    eprint("Not placed after a command that cannot be resolved (" + str(e) +
+                           "): " + line.rstrip())
+                    prev = st
+                    continue
+            free = used[addr_line].find(0, want)
+            if (free < 0):
+                free = used[addr_line].find(0)
+            if (free < 0):
+                eprint("No free word in line " + bin_to_dstr(addr_line) + " for asm line: " + line.rstrip())
+            else:
+                used[addr_line][free] = 1
+                st[1] = free
+                if (name is not None):
+                    symbols[name][2] = free
+        prev = st
+    # Pass 2: statements
+    blocks = {}
+    for i in range(len(stmts)):
+        [addr_line, addr_word, stmt, line, name] = stmts[i]
+        if (addr_word is None):
+            continue
+        next_waddr = None
+        if (i + 1 < len(stmts) and stmts[i + 1][0] == addr_line):
+            next_waddr = stmts[i + 1][1]
+        try:
+            [data, is_asm] = asm_resolve(stmt, symbols, addr_word, next_waddr)
+        except ValueError as e:
+            eprint(e)
+            continue
+        if (addr_line not in blocks):
+            blocks[addr_line] = Block.unused()
+        block = blocks[addr_line]
+        if (block.is_valid(addr_word)):
+            eprint("Duplicate address in asm file: " + line.rstrip())
+        else:
+            block.set_word(addr_word, data, 'A' if is_asm else 'C')
+    return [[[addr_line, blocks[addr_line]] for addr_line in sorted(blocks)], symbols]
+
+def print_symbols(symbols, list_file):
+    print("\nSymbols:", file=list_file)
+    for name in sorted(symbols):
+        value = symbols[name]
+        if (value[0] == 'A'):
+            text = bin_to_dstr(value[1]) + ":" + (bin_to_dstr(value[2]) if (value[2] is not None) else "*")
+        elif (value[0] == 'N'):
+            text = bin_to_dstr(value[1])
+        else:
+            text = word29_to_str(value[1])
+        print("    " + name + " = " + text, file=list_file)
 
 # -----------------------------------------------------------------------------
 # G-15 disassembler
@@ -538,7 +1120,7 @@ def print_block_raw(block, list_file):
             print("", file=list_file)
         if (i % 10 == 0):
             print("    " + bin_to_dstr(i) + ":", end="", sep="", file=list_file)
-        if (block[i] == 0xf0000000):
+        if (not block.is_valid(i)):
             print("   --------", end="", file=list_file)
         else:
             print(" ", word29_to_str(block[i]), end="", file=list_file)
@@ -569,9 +1151,10 @@ def command_to_pprasm(word):
 def incr_waddr(a):
     return (a + 1) % 108
 
-def command_to_semantics(word, waddr):
+def command_timing(word, waddr):
+    # Whether the command at waddr is immediate, and the first and last
+    # word times of its execution
     [i_d, t, bp, n, ch, s, d, s_d, p, c] = decode_word(word)
-    semantics = ""
     # immediate command
     is_imm = (i_d == 0)
     # immediate command with relative timing
@@ -591,20 +1174,30 @@ def command_to_semantics(word, waddr):
             # so we fall back to T as a word counter for all relative timing
             # commands
             end_waddr = (t + 108 + start_waddr - 1) % 108
-        if (start_waddr != end_waddr):
-            semantics += "I [" + bin_to_dstr(start_waddr) + ":" + bin_to_dstr(end_waddr) + "]"
-        else:
-            semantics += "I    [" + bin_to_dstr(start_waddr) + "]"
     else:
-        start_waddr = t
-        if ((d == 31) and (s == 21)) or (s_d == 0):
+        start_waddr = t % 108
+        # Deferred specials run one word time: with D = 31 the S/D bit
+        # belongs to the next command line C, not to a word pair
+        if (d == 31) or (s_d == 0):
             end_waddr = start_waddr
         else:
             end_waddr = start_waddr
-            if (end_waddr & 1 == 1):
-                # a double-word command starting at an odd address
-                # transfers just one word
+            if (end_waddr & 1 == 0):
+                # a double-word command transfers an even/odd word pair;
+                # starting at an odd address it transfers just one word
                 end_waddr = incr_waddr(end_waddr)
+    return [is_imm, start_waddr, end_waddr]
+
+def command_to_semantics(word, waddr):
+    [i_d, t, bp, n, ch, s, d, s_d, p, c] = decode_word(word)
+    semantics = ""
+    [is_imm, start_waddr, end_waddr] = command_timing(word, waddr)
+    if is_imm:
+        if (start_waddr != end_waddr):
+            semantics += "I [" + bin_to_dstr(start_waddr) + ":" + bin_to_dstr(end_waddr) + "]"
+        else:
+            semantics += "I    [" + bin_to_dstr(start_waddr) + "]"
+    else:
         if (start_waddr != end_waddr):
             semantics += "D [" + bin_to_dstr(start_waddr) + ":" + bin_to_dstr(end_waddr) + "]"
         else:
@@ -682,24 +1275,129 @@ def command_to_semantics(word, waddr):
         semantics += " " + s_name[s] + "->" + tr_type[ttype] + "->" + d_name[d]
     return semantics
 
-def print_block_decoded(block_data, block_map, list_file):
+def print_block_decoded(block, list_file):
+    # Assembled blocks are listed in source order, others from word 0 up
     print("\nDecoded block data:", file=list_file)
-    for i in range(len(block_map)):
-        kind = block_map[i][0]
-        addr = block_map[i][1]
-        word = block_data[addr]
+    for addr in (block.order if (block.order is not None) else range(len(block))):
+        kind = block.kind(addr)
+        word = block[addr]
         print("    " + bin_to_dstr(addr) + ": ", end="", sep="", file=list_file)
         if (kind == 'C'):
             print(word29_to_str(word), sep="", file=list_file)
         else:
             print(command_to_pprasm(word), "   # ", command_to_semantics(word, addr), sep="", file=list_file)
  
+# -----------------------------------------------------------------------------
+# Static word time costs. A command at L takes 1 word time to read, waits
+# for its first word (deferred commands), runs from start to end (see
+# command_timing), and then waits for the drum to bring word N around
+# (unless it ends the path, see command_successors).
+# Commands that wait COST_LOSS or more word times have lost (nearly) a
+# whole revolution and are flagged.
+# -----------------------------------------------------------------------------
+COST_LOSS = 100
+
+def command_cost(word, waddr):
+    # [wait for the first word, word times running, wait for N]
+    [i_d, t, bp, n, ch, s, d, s_d, p, c] = decode_word(word)
+    [is_imm, start_waddr, end_waddr] = command_timing(word, waddr)
+    wait = 0 if is_imm else (start_waddr - waddr - 2) % 108 + 1
+    run = (end_waddr - start_waddr) % 108 + 1
+    next_wait = (n - end_waddr - 1) % 108
+    if (command_successors(word) == []):
+        next_wait = 0
+    return [wait, run, next_wait]
+
+def command_successors(word):
+    # Word addresses the next command may come from in the same line.
+    # Tests continue at N or, one word time later, at N+1. Halts, mark and
+    # return exits and commands taken from AR end the path.
+    [i_d, t, bp, n, ch, s, d, s_d, p, c] = decode_word(word)
+    if (d == 31):
+        if (s == 16 or s == 20 or s == 21 or (s == 31 and ch == 0)):
+            return []
+        if (s == 22 or s == 28 or s == 29):
+            return [n, incr_waddr(n)]
+    elif (d == 27):
+        return [n, incr_waddr(n)]
+    return [n]
+
+def cost_paths(block, entries):
+    # Straight-line paths through the commands of block from the entries.
+    # Returns [addresses, word times, end] for each path; a test starts a
+    # new path at its N+1 successor.
+    paths = []
+    visited = set()
+    work = list(entries)
+    for start in work:
+        if (start in visited):
+            continue
+        addrs = []
+        wt = 0
+        addr = start
+        end = "exit"
+        while True:
+            if (addr in visited):
+                end = "joins " + bin_to_dstr(addr)
+                break
+            if (not block.is_valid(addr) or block.kind(addr) != 'A'):
+                end = "no command at " + bin_to_dstr(addr)
+                break
+            visited.add(addr)
+            addrs.append(addr)
+            word = block[addr]
+            [wait, run, next_wait] = command_cost(word, addr)
+            wt += 1 + wait + run + next_wait
+            succ = command_successors(word)
+            if (len(succ) > 1):
+                work.append(succ[1])
+            if (succ == []):
+                break
+            addr = succ[0]
+        paths.append([addrs, wt, end])
+    return paths
+
+def print_cost_report(block, entries, cost_file):
+    print("Word time costs:    RC + wait + run + next = total", file=cost_file)
+    total = 0
+    lost = 0
+    for addr in (block.order if (block.order is not None) else range(len(block))):
+        if (not block.is_valid(addr) or block.kind(addr) != 'A'):
+            continue
+        word = block[addr]
+        [wait, run, next_wait] = command_cost(word, addr)
+        wt = 1 + wait + run + next_wait
+        total += wt
+        flag = ""
+        if (wait >= COST_LOSS or next_wait >= COST_LOSS):
+            flag = "   <-- lost revolution"
+            lost += 1
+        print("    " + bin_to_dstr(addr) + ": " + command_to_pprasm(word) +
+              "  {:3d} + {:3d} + {:3d} + {:3d} = {:3d}".format(1, wait, run, next_wait, wt) +
+              "   # " + command_to_semantics(word, addr) + flag, file=cost_file)
+    print("Total:", total, "word times, lost revolutions:", lost, file=cost_file)
+    print("\nPaths:", file=cost_file)
+    for [addrs, wt, end] in cost_paths(block, entries):
+        if (addrs == []):
+            continue
+        print("    From " + bin_to_dstr(addrs[0]) + ": " + str(len(addrs)) + " commands, " +
+              str(wt) + " word times, " + end, file=cost_file)
+        print("        " + " ".join(bin_to_dstr(addr) for addr in addrs), file=cost_file)
+
 def usage():
     eprint("Usage: g15util.py cmd [args]")
     eprint("Commands:")
-    eprint("  g15util.py asm <input file>")
+    eprint("  g15util.py asm [-m] <input file>")
     eprint("  g15util.py dis <input file> [block_no]")
-    eprint("  g15util.py cvt -t \"pt\" | \"pti\" <input file>")
+    eprint("  g15util.py cost [-e word] <input file>")
+    eprint("  g15util.py cvt -t \"pt\" | \"pti\" | \"mem\" | \"g15b\" <input file>")
+    eprint("  g15util.py run [-l line] [-e line:word] [-m word_times] [-t tape] [-b] [-p] [-s snapshot] [-r | --resume snapshot] [-o | --punch pt file] [-L | --log output log] <input file>")
+    eprint("  g15util.py drum [-f \"v\" | \"memb\"] [-i instance] [-o output] [-n] <line>:<input file> ...")
+    eprint("  g15util.py regress [-j jobs] [-m word_times] [-o summary file] [-r | --resume snapshot] <directory | .asm files>")
+    eprint("  g15util.py build [-j jobs] [-m] [-f] <directory | .asm files>")
+    eprint("  g15util.py trace [-c clock] [-w word sync] [-r drum sync] [-s signal,...] [-d] [-n words] <.vcd | $display log>")
+    eprint("  g15util.py cosim [-l line:file ...] [-t tape] [-r snapshot] [-c context] [-m word_times] <$display log>")
+    eprint("  g15util.py sweep [-l line] [-e line:word] [-m word_times] [-r AR | line:word] [-o output] <input file> <values file>")
     sys.exit(1)
 
 def open_input_file(fn, f_mode="r"):
@@ -722,31 +1420,103 @@ def open_output_file(fn, f_mode="w"):
     return f
 
 def assemble():
-    if (len(sys.argv) != 3):
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "m")
+    except getopt.GetoptError as err:
+        eprint(str(err))
         usage()
-    asm_fn = sys.argv[2]
+    multi = False
+    for o, a in opts:
+        if o == "-m":
+            multi = True
+        else:
+            usage()
+    if (len(args) != 1):
+        usage()
+    asm_fn = args[0]
     fname, fext = os.path.splitext(asm_fn)
     if fext != ".asm":
         eprint("Error: Input filename must have .asm extension:", asm_fn)
         sys.exit(1)
-    asm_file = open_input_file(asm_fn)
-    list_fn = fname + ".lst"
-    list_file = open_output_file(list_fn)
-    pti_fn = fname + ".pti"
-    pti_file = open_output_file(pti_fn)
     print("Assembling:", asm_fn)
-    [block, block_map] = assemble_file(asm_file)
-    print_block_raw(block, list_file)
-    # replace unused words in block with 0
-    for i in range(len(block)):
-        if (block[i] == 0xf0000000):
-            block[i] = 0
-    print("\nCalculated checksum:", word29_to_str(checksum(block)), file=list_file)
-    print_block_decoded(block, block_map, list_file)
-    print_pti_block(block, pti_file)
-    list_file.close()
-    pti_file.close()
+    assemble_outputs(asm_fn, multi)
+
+def assemble_outputs(asm_fn, multi):
+    # Assemble asm_fn into its .lst and .pti files. Each file is rendered in
+    # memory and then replaces the old one in a single step.
+    fname, fext = os.path.splitext(asm_fn)
+    asm_file = open_input_file(asm_fn)
+    list_file = io.StringIO()
+    pti_file = io.StringIO()
+    if multi:
+        [lines, symbols] = assemble_multi_file(asm_file)
+        block_no = 0
+        for [line, block] in lines:
+            print("Block " + str(block_no) + ": Line " + bin_to_dstr(line), file=list_file)
+            print_block_raw(block, list_file)
+            print("\nCalculated checksum:", word29_to_str(checksum(block)), file=list_file)
+            print_block_decoded(block, list_file)
+            print("", file=list_file)
+            print_pti_block(block, pti_file)
+            block_no += 1
+        print_symbols(symbols, list_file)
+    else:
+        block = assemble_file(asm_file)
+        print_block_raw(block, list_file)
+        # unused words in the block are 0
+        print("\nCalculated checksum:", word29_to_str(checksum(block)), file=list_file)
+        print_block_decoded(block, list_file)
+        print_pti_block(block, pti_file)
     asm_file.close()
+    write_file_atomic(fname + ".lst", list_file.getvalue())
+    write_file_atomic(fname + ".pti", pti_file.getvalue())
+
+def write_file_atomic(fn, text):
+    # Readers see either the old or the new file, never a partial one
+    tmp_fn = fn + ".tmp" + str(os.getpid())
+    tmp_file = open_output_file(tmp_fn)
+    tmp_file.write(text)
+    tmp_file.close()
+    try:
+        os.replace(tmp_fn, fn)
+    except OSError:
+        os.remove(tmp_fn)
+        raise
+
+def cost():
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "e:")
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    entry = None
+    for o, a in opts:
+        if o == "-e":
+            try:
+                entry = dstr_to_bin(a)
+            except ValueError:
+                usage()
+            if (entry > 107):
+                usage()
+    if (len(args) != 1):
+        usage()
+    fname, fext = os.path.splitext(args[0])
+    blocks = read_input_blocks(args[0])
+    cost_file = io.StringIO()
+    block_no = 0
+    for block in blocks:
+        if (len(blocks) > 1):
+            print("Block " + str(block_no) + ":", file=cost_file)
+        if (entry is not None):
+            entries = [entry]
+        elif (block.order is not None and block.order != []):
+            entries = [block.order[0]]
+        else:
+            entries = [0]
+        print_cost_report(block, entries, cost_file)
+        print("", file=cost_file)
+        block_no += 1
+    write_file_atomic(fname + ".cost", cost_file.getvalue())
 
 def disassemble():
     if (len(sys.argv) > 4):
@@ -760,32 +1530,122 @@ def disassemble():
             usage()
         
     fname, fext = os.path.splitext(dis_fn)
-    if fext == ".pt":
-        dis_file = open_input_file(dis_fn, "rb")
-    else:
-        dis_file = open_input_file(dis_fn)
     list_fn = fname + ".dislst"
-    list_file = open_output_file(list_fn)
-    blocks = []
-    if fext == ".pti":
-        blocks = read_pti_file(dis_file)
-    elif fext == ".pt":
-        blocks = read_pt_file(dis_file)
+    if single_block:
+        # Only the requested block is located (via the block index) and decoded
+        block = read_tape_block(dis_fn, block_no)
+        if len(block) == 0:
+            eprint("Error: Block not found:", block_no)
+            sys.exit(1)
+        blocks = [block]
+        dis_file = None
+    elif fext == ".g15b":
+        blocks = read_g15b_file(dis_fn)
+        dis_file = None
+        block_no = 0
     else:
-        blocks = read_json_file(dis_file)
-    block_no = 0
+        if fext == ".pt":
+            dis_file = open_input_file(dis_fn, "rb")
+        else:
+            dis_file = open_input_file(dis_fn)
+        if fext == ".pti":
+            blocks = read_pti_file(dis_file)
+        elif fext == ".pt":
+            blocks = iter_pt_file(dis_file)
+        else:
+            blocks = read_json_file(dis_file)
+        block_no = 0
+    list_file = open_output_file(list_fn)
     for block in blocks:
         print("\nBlock number:", block_no, file=list_file)
         print_block_raw(block, list_file)
         print("\nCalculated checksum:", word29_to_str(checksum(block)), file=list_file)
-        # create simple block map, all words are considered to be commands
-        block_map = []
-        for i in range(len(block)):
-            block_map.append(['A', i])
-        print_block_decoded(block, block_map, list_file)
+        # all words of a tape block are considered to be commands
+        print_block_decoded(block, list_file)
         block_no += 1
     list_file.close()
-    dis_file.close()
+    if dis_file:
+        dis_file.close()
+
+def pt_tape_pieces(blocks):
+    # Punched tape for each block preceded by its leader or inter-block
+    # gap. The trailer is added to the last piece.
+    pieces = []
+    blanks = 30
+    for block in blocks:
+        pt_file = io.BytesIO()
+        pt_file.write(bytes(blanks))
+        blanks = 75
+        print_pt_block(block, pt_file)
+        pieces.append(pt_file.getvalue())
+    if pieces == []:
+        pieces.append(b"")
+    pieces[-1] += bytes(30)
+    return pieces
+
+def pt_file_pieces(pt_file):
+    # An existing tape is kept byte for byte, cut after each stop code
+    spans = index_pt_file(pt_file)
+    pt_file.seek(0)
+    data = pt_file.read()
+    if spans == []:
+        return [data]
+    pieces = []
+    start = 0
+    for [span_start, span_end] in spans:
+        pieces.append(data[start:span_end])
+        start = span_end
+    pieces[-1] += data[start:]
+    return pieces
+
+def print_mem_file(data, mem_file, title):
+    # Hex dump in the layout of bxtst.mem for $readmemh
+    print("// ------------------------------------------------------------------", file=mem_file)
+    for line in title:
+        print(("// " + line).rstrip(), file=mem_file)
+    print("//", file=mem_file)
+    print("// Bytes contain a bit-reversed 5-level G-15 code in their", file=mem_file)
+    print("// low-order 5 bits. Runs of 00 are blank tape.", file=mem_file)
+    print("// ------------------------------------------------------------------", file=mem_file)
+    for i in range(0, len(data), 16):
+        print(" ".join(["%02x" % b for b in data[i:i+16]]), file=mem_file)
+
+def write_mem_files(pieces, fname, source):
+    # Pack whole blocks into segments no larger than the tape reader buffer.
+    # A tape that needs more than one segment gets numbered segment files
+    # and a manifest.
+    segments = []
+    for i in range(len(pieces)):
+        if len(pieces[i]) > MEM_SEGMENT_SIZE:
+            eprint("Error: Block", i, "does not fit a", MEM_SEGMENT_SIZE, "byte tape segment")
+            sys.exit(1)
+        if segments != [] and len(segments[-1][0]) + len(pieces[i]) <= MEM_SEGMENT_SIZE:
+            segments[-1][0] += pieces[i]
+            segments[-1][2] = i
+        else:
+            segments.append([pieces[i], i, i])
+    manifest = {"source": source, "segment_size": MEM_SEGMENT_SIZE, "segments": []}
+    for seg_no in range(len(segments)):
+        [data, first_block, last_block] = segments[seg_no]
+        if len(segments) == 1:
+            mem_fn = fname + ".mem"
+        else:
+            mem_fn = fname + "_" + format(seg_no, "02d") + ".mem"
+        title = [os.path.basename(mem_fn) + ": G-15 paper tape for hdl/sim/tape_reader.sv",
+                 "",
+                 "Converted from " + os.path.basename(source) + " by: g15util.py cvt -t mem"]
+        if len(segments) > 1:
+            title.append("Segment " + str(seg_no) + " of " + str(len(segments)) +
+                         ", blocks " + str(first_block) + "-" + str(last_block))
+        mem_file = open_output_file(mem_fn)
+        print_mem_file(data, mem_file, title)
+        mem_file.close()
+        manifest["segments"].append({"file": os.path.basename(mem_fn), "bytes": len(data),
+                                     "first_block": first_block, "last_block": last_block})
+    if len(segments) > 1:
+        manifest_file = open_output_file(fname + ".mem.json")
+        json.dump(manifest, manifest_file, indent=2)
+        manifest_file.close()
 
 def convert():
     try:
@@ -802,6 +1662,12 @@ def convert():
             elif a == "pti":
                 print("Converting to PTI...")
                 target_ft = "pti"
+            elif a == "mem":
+                print("Converting to MEM...")
+                target_ft = "mem"
+            elif a == "g15b":
+                print("Converting to G15B...")
+                target_ft = "g15b"
             else:
                 usage()
         else:
@@ -813,7 +1679,7 @@ def convert():
 
     cvt_fn = args[0]
     fname, fext = os.path.splitext(cvt_fn)    
-    if fext == ".pt":
+    if fext == ".pt" or fext == ".g15b":
         cvt_file = open_input_file(cvt_fn, "rb")
     else:
         cvt_file = open_input_file(cvt_fn)
@@ -821,7 +1687,11 @@ def convert():
     if fext == ".pti":
         blocks = read_pti_file(cvt_file)
     elif fext == ".pt":
-        blocks = read_pt_file(cvt_file)
+        blocks = iter_pt_file(cvt_file)
+    elif fext == ".asm":
+        blocks = read_input_blocks(cvt_fn)
+    elif fext == ".g15b":
+        blocks = read_g15b_file(cvt_fn)
     else:
         blocks = read_json_file(cvt_file)
     print("target_ft:", target_ft)
@@ -829,14 +1699,8 @@ def convert():
         print("Converting to pt...")
         pt_fn = fname + ".pt"
         pt_file = open_output_file(pt_fn, "wb")
-        blanks = 30
-        for block in blocks:
-            for ctr in range(0, blanks):
-                pt_file.write(bytes([0]))
-            blanks = 75
-            print_pt_block(block, pt_file)
-        for ctr in range(0, 30):
-            pt_file.write(bytes([0]))
+        for piece in pt_tape_pieces(blocks):
+            pt_file.write(piece)
         pt_file.close()
     elif target_ft == "pti":
         print("Converting to pti...")
@@ -845,8 +1709,749 @@ def convert():
         for block in blocks:
             print_pti_block(block, pti_file)
         pti_file.close()
+    elif target_ft == "mem":
+        print("Converting to mem...")
+        if fext == ".pt":
+            pieces = pt_file_pieces(cvt_file)
+        else:
+            pieces = pt_tape_pieces(blocks)
+        write_mem_files(pieces, fname, cvt_fn)
+    elif target_ft == "g15b":
+        print("Converting to g15b...")
+        if fext == ".g15b":
+            eprint("Error: Input file is already .g15b:", cvt_fn)
+            sys.exit(1)
+        provenance = {"source": os.path.basename(cvt_fn), "format": fext[1:],
+                      "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                      "tool": "g15util.py cvt -t g15b"}
+        g15b_file = open_output_file(fname + ".g15b", "wb")
+        write_g15b_file(blocks, g15b_file, provenance)
+        g15b_file.close()
     cvt_file.close()
 
+def read_input_blocks(fn):
+    # Read every block of a .pti, .pt, .json, .g15b or .asm file
+    fname, fext = os.path.splitext(fn)
+    if fext == ".asm":
+        in_file = open_input_file(fn)
+        block = assemble_file(in_file)
+        in_file.close()
+        return [block]
+    if fext == ".g15b":
+        return read_g15b_file(fn)
+    if fext == ".pt":
+        in_file = open_input_file(fn, "rb")
+        blocks = read_pt_file(in_file)
+    else:
+        in_file = open_input_file(fn)
+        if fext == ".pti":
+            blocks = read_pti_file(in_file)
+        else:
+            blocks = read_json_file(in_file)
+    in_file.close()
+    return blocks
+
+def open_tape(fn):
+    # Photo reader with the tape in fn mounted. A .pt file is mapped as it
+    # is; the blocks of any other file are punched into a tape image first.
+    import g15emu
+    fname, fext = os.path.splitext(fn)
+    if fext == ".pt":
+        pt_file = open_input_file(fn, "rb")
+        reader = g15emu.open_pt_tape(pt_file)
+        pt_file.close()
+        return reader
+    return g15emu.PhotoReader(b"".join(pt_tape_pieces(read_input_blocks(fn))))
+
+def run():
+    import g15emu
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "l:e:m:t:bpr:s:o:L:",
+                                   ["resume=", "save=", "punch=", "log="])
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    load_line = 0
+    entry = ""
+    max_wt = 108 * 100000
+    tape_fn = ""
+    bp_switch = False
+    profile = False
+    resume_fn = ""
+    save_fn = ""
+    punch_fn = ""
+    log_fn = ""
+    try:
+        for o, a in opts:
+            if o == "-l":
+                load_line = int(a)
+            elif o == "-e":
+                entry = a
+            elif o == "-m":
+                max_wt = int(a)
+            elif o == "-t":
+                tape_fn = a
+            elif o == "-b":
+                bp_switch = True
+            elif o == "-p":
+                profile = True
+            elif o in ("-r", "--resume"):
+                resume_fn = a
+            elif o in ("-s", "--save"):
+                save_fn = a
+            elif o in ("-o", "--punch"):
+                punch_fn = a
+            elif o in ("-L", "--log"):
+                log_fn = a
+    except ValueError:
+        usage()
+    # Resuming from a snapshot, the input file is optional
+    if (len(args) > 1 or (len(args) == 0 and resume_fn == "")):
+        usage()
+    if (load_line < 0 or load_line > 23):
+        eprint("Error: Invalid load line:", load_line)
+        sys.exit(1)
+    # Entry point is given as line:word, e.g. 00:04 for 00[04]. A resumed
+    # run continues at the saved next command unless -e is given.
+    if (entry == "" and resume_fn == ""):
+        entry = bin_to_dstr(load_line) + ":00"
+    if (entry != ""):
+        fields = entry.split(":")
+        try:
+            entry_line = int(fields[0])
+            entry_word = dstr_to_bin(fields[1]) if len(fields) == 2 else 0
+        except ValueError:
+            eprint("Error: Invalid entry point:", entry)
+            sys.exit(1)
+        if (entry_line not in g15emu.cl_line or entry_word > 107):
+            eprint("Error: Invalid entry point:", entry)
+            sys.exit(1)
+
+    g15 = g15emu.G15()
+    if resume_fn != "":
+        snap_file = open_input_file(resume_fn, "rb")
+        try:
+            g15.restore(snap_file)
+        except ValueError as e:
+            eprint("Error:", e, resume_fn)
+            sys.exit(1)
+        snap_file.close()
+    blocks = []
+    tape = None
+    if (len(args) == 1):
+        if (os.path.splitext(args[0])[1] == ".pt"):
+            # A paper tape is mapped rather than parsed: its first block is
+            # loaded and the rest stays on the photo reader
+            tape = open_tape(args[0])
+            block = tape.read_block()[0]
+            tape.chars = 0
+            blocks = [block] if (block is not None) else []
+        else:
+            blocks = read_input_blocks(args[0])
+            tape = g15emu.PhotoReader(b"".join(pt_tape_pieces(blocks[1:])))
+        if blocks == []:
+            eprint("Error: No blocks in input file:", args[0])
+            sys.exit(1)
+        g15.load(load_line, blocks[0])
+    if tape_fn != "":
+        # A resumed tape continues at the saved position
+        reader = g15.reader
+        g15.mount_tape(open_tape(tape_fn))
+        g15.reader.pos = reader.pos
+        g15.reader.chars = reader.chars
+    elif resume_fn == "":
+        g15.mount_tape(tape)
+    if (entry != ""):
+        g15.cd = g15emu.cl_line.index(entry_line)
+        g15.n = entry_word
+    g15.bp_switch = bp_switch
+    if profile:
+        g15.profile = {}
+    # Punch output goes to a .pt image, and typing and punching are logged
+    # by word time, when asked for
+    punch_file = open_output_file(punch_fn, "wb") if (punch_fn != "") else None
+    log_file = open_output_file(log_fn) if (log_fn != "") else None
+    g15.output = g15emu.OutputSink(sys.stdout, punch_file, log_file)
+    g15.run(max_wt)
+    if punch_file:
+        punch_file.close()
+    if log_file:
+        log_file.close()
+    g15emu.print_state(g15)
+    if save_fn != "":
+        snap_file = open_output_file(save_fn, "wb")
+        g15.save(snap_file)
+        snap_file.close()
+    if profile:
+        # Annotated listing and the same profile as JSON
+        fname, fext = os.path.splitext(args[0] if (len(args) == 1) else resume_fn)
+        prof_file = open_output_file(fname + ".prof")
+        g15emu.print_profile(g15, prof_file)
+        prof_file.close()
+        prof_file = open_output_file(fname + ".prof.json")
+        json.dump(g15emu.profile_summary(g15), prof_file, indent=1)
+        prof_file.close()
+
+# -----------------------------------------------------------------------------
+# Drum preload images. A drum_track shifts right and presents dreg[0] first,
+# and the TM track makes bit time T1 the first clock after reset, so bit b
+# of word w of a line is bit 29 * w + b of the track's initial value.
+# The number track is preloaded as well; a testbench that starts from a
+# preloaded drum must skip the power-up sequence that clears and reloads it.
+# -----------------------------------------------------------------------------
+# Track instances below g15_top and their lengths in bits
+drum_tracks = {
+    "nt": ["cpu_top_inst.control_gate_inst.track_NT", 3132],
+    "19": ["io_top_inst.io_11_mz.track_M19", 3132],
+    "20": ["mem_top_inst.mem_20_21_22_inst.track_20", 116],
+    "21": ["mem_top_inst.mem_20_21_22_inst.track_21", 116],
+    "22": ["mem_top_inst.mem_20_21_22_inst.track_22", 116],
+    "23": ["io_top_inst.io_11_mz.track_M23", 116]}
+for line in range(0, 19):
+    inst = "mem_0_6_inst" if line < 7 else "mem_7_18_inst"
+    drum_tracks[bin_to_dstr(line)] = ["mem_top_inst." + inst + ".track_M" + str(line), 3132]
+
+def number_track():
+    # Word w holds T = N = w + 1 with bit 29 set, word 107 holds the word
+    # the number track block of bxtst.pt ends with
+    block = [(1 << 28) | ((w + 1) << 21) | ((w + 1) << 13) for w in range(107)]
+    block.append(0x2828f29)
+    return block
+
+def drum_image(block, bits):
+    # Initial value of a track holding block from word 0 up
+    image = 0
+    for w in range(bits // 29):
+        if (w < len(block)):
+            image |= (block[w] & 0x1fffffff) << (29 * w)
+    return image
+
+def drum():
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "f:i:o:n")
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    drum_ft = "v"
+    instance = "g15_top_uut"
+    out_fn = ""
+    with_nt = True
+    for o, a in opts:
+        if o == "-f":
+            if a != "v" and a != "memb":
+                usage()
+            drum_ft = a
+        elif o == "-i":
+            instance = a
+        elif o == "-o":
+            out_fn = a
+        elif o == "-n":
+            with_nt = False
+    if len(args) == 0:
+        usage()
+    # Each argument loads the first block of a file into a line: <line>:<file>
+    images = {}
+    if with_nt:
+        images["nt"] = number_track()
+    for arg in args:
+        fields = arg.split(":", 1)
+        if len(fields) != 2:
+            usage()
+        try:
+            line = bin_to_dstr(int(fields[0]))
+        except ValueError:
+            line = ""
+        if line not in drum_tracks:
+            eprint("Error: Invalid drum line:", fields[0])
+            sys.exit(1)
+        blocks = read_input_blocks(fields[1])
+        if blocks == []:
+            eprint("Error: No blocks in input file:", fields[1])
+            sys.exit(1)
+        images[line] = blocks[0]
+
+    if drum_ft == "v":
+        # defparam statements for the V parameter of each drum_track
+        if out_fn == "":
+            out_fn = "drum_preload.svh"
+        out_file = open_output_file(out_fn)
+        print("// Drum preload generated by: g15util.py drum", " ".join(sys.argv[2:]), file=out_file)
+        for line in images:
+            [path, bits] = drum_tracks[line]
+            print("defparam " + instance + "." + path + ".V = " + str(bits) + "'h" +
+                  format(drum_image(images[line], bits), "0" + str((bits + 3) // 4) + "x") + ";",
+                  file=out_file)
+        out_file.close()
+    else:
+        # One $readmemb file per track holding a single bits-wide word
+        if out_fn == "":
+            out_fn = "drum"
+        for line in images:
+            [path, bits] = drum_tracks[line]
+            memb_fn = out_fn + "_" + ("nt" if (line == "nt") else "m" + line) + ".memb"
+            memb_file = open_output_file(memb_fn)
+            print("// Initial value of " + path + " (" + str(bits) + " bits)", file=memb_file)
+            print(format(drum_image(images[line], bits), "0" + str(bits) + "b"), file=memb_file)
+            memb_file.close()
+
+def trace():
+    import g15trace
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "c:w:r:s:dn:")
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    clock = "CLOCK"
+    t29 = "T29"
+    t0 = "T0"
+    signals = ["AA"]
+    disassemble = False
+    max_words = -1
+    try:
+        for o, a in opts:
+            if o == "-c":
+                clock = a
+            elif o == "-w":
+                t29 = a
+            elif o == "-r":
+                t0 = a
+            elif o == "-s":
+                signals = a.split(",")
+            elif o == "-d":
+                disassemble = True
+            elif o == "-n":
+                max_words = int(a)
+    except ValueError:
+        usage()
+    if len(args) != 1:
+        usage()
+    fname, fext = os.path.splitext(args[0])
+    trace_file = open_input_file(args[0])
+    try:
+        if fext == ".vcd":
+            records = g15trace.iter_vcd_words(trace_file, clock, t29, t0, signals)
+            if (max_words >= 0):
+                records = itertools.islice(records, max_words)
+            g15trace.print_vcd_words(records, signals, disassemble)
+        else:
+            g15trace.print_display_log(g15trace.iter_display_log(trace_file), disassemble)
+    except ValueError as e:
+        eprint("Error:", e)
+        sys.exit(1)
+    trace_file.close()
+
+def cosim():
+    import g15emu
+    import g15trace
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "l:t:r:c:m:")
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    loads = []
+    tape_fn = ""
+    resume_fn = ""
+    context = 10
+    max_wt = 108 * 1000000
+    try:
+        for o, a in opts:
+            if o == "-l":
+                # <line>:<file> loads the first block of a file into a line
+                fields = a.split(":", 1)
+                if len(fields) != 2:
+                    usage()
+                loads.append([int(fields[0]), fields[1]])
+            elif o == "-t":
+                tape_fn = a
+            elif o == "-r":
+                resume_fn = a
+            elif o == "-c":
+                context = int(a)
+            elif o == "-m":
+                max_wt = int(a)
+    except ValueError:
+        usage()
+    if len(args) != 1:
+        usage()
+    g15 = g15emu.G15()
+    if resume_fn != "":
+        snap_file = open_input_file(resume_fn, "rb")
+        try:
+            g15.restore(snap_file)
+        except ValueError as e:
+            eprint("Error:", e, resume_fn)
+            sys.exit(1)
+        snap_file.close()
+    for [line, fn] in loads:
+        if (line < 0 or line > 23):
+            eprint("Error: Invalid load line:", line)
+            sys.exit(1)
+        blocks = read_input_blocks(fn)
+        if blocks == []:
+            eprint("Error: No blocks in input file:", fn)
+            sys.exit(1)
+        g15.load(line, blocks[0])
+    if tape_fn != "":
+        reader = g15.reader
+        g15.mount_tape(open_tape(tape_fn))
+        g15.reader.pos = reader.pos
+        g15.reader.chars = reader.chars
+    log_file = open_input_file(args[0])
+    same = g15trace.cosim(g15, g15trace.iter_display_log(log_file), context, g15.wt + max_wt)
+    g15.output.flush()
+    log_file.close()
+    if not same:
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------
+# Parameter sweeps: one block run in many lanes of the lane-parallel
+# emulator, each lane starting with its own value in AR or a drum word
+# -----------------------------------------------------------------------------
+def sweep():
+    import g15lanes
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "l:e:m:r:o:")
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    load_line = 0
+    entry = ""
+    max_wt = 108 * 100000
+    register = "AR"
+    out_fn = ""
+    try:
+        for o, a in opts:
+            if o == "-l":
+                load_line = int(a)
+            elif o == "-e":
+                entry = a
+            elif o == "-m":
+                max_wt = int(a)
+            elif o == "-r":
+                register = a
+            elif o == "-o":
+                out_fn = a
+    except ValueError:
+        usage()
+    if len(args) != 2:
+        usage()
+    if (g15lanes.np is None):
+        eprint("Error: sweep needs NumPy")
+        sys.exit(1)
+    if (load_line < 0 or load_line > 23):
+        eprint("Error: Invalid load line:", load_line)
+        sys.exit(1)
+    if (entry == ""):
+        entry = bin_to_dstr(load_line) + ":00"
+    fields = entry.split(":")
+    try:
+        entry_line = int(fields[0])
+        entry_word = dstr_to_bin(fields[1]) if len(fields) == 2 else 0
+    except ValueError:
+        eprint("Error: Invalid entry point:", entry)
+        sys.exit(1)
+    if (entry_line not in g15lanes.cl_line or entry_word > 107):
+        eprint("Error: Invalid entry point:", entry)
+        sys.exit(1)
+    # The swept register is AR or a drum word given as line:word, e.g.
+    # 24:01 for the odd (high) word of MQ
+    if (register != "AR"):
+        fields = register.split(":")
+        try:
+            reg_line = int(fields[0])
+            reg_word = dstr_to_bin(fields[1]) if len(fields) == 2 else 0
+        except ValueError:
+            eprint("Error: Invalid register:", register)
+            sys.exit(1)
+        if (reg_line < 0 or reg_line > 26 or reg_word > 107):
+            eprint("Error: Invalid register:", register)
+            sys.exit(1)
+
+    blocks = read_input_blocks(args[0])
+    if blocks == []:
+        eprint("Error: No blocks in input file:", args[0])
+        sys.exit(1)
+    # One starting value per line of the values file
+    values = []
+    values_file = open_input_file(args[1])
+    for text in values_file:
+        text = strip_comments_whitespace(text)
+        if (text == ""):
+            continue
+        try:
+            values.append(str_to_word29(text) & 0x1fffffff)
+        except ValueError:
+            eprint("Error: Invalid value:", text)
+            sys.exit(1)
+    values_file.close()
+
+    g = g15lanes.G15Lanes(len(values))
+    g.load(load_line, blocks[0])
+    if (register == "AR"):
+        g.ar[:] = values
+    else:
+        g.mem[g.row(reg_line, reg_word), :] = values
+    g.cd[:] = g15lanes.cl_line.index(entry_line)
+    g.n[:] = entry_word
+    g.run(max_wt)
+    out_file = open_output_file(out_fn) if (out_fn != "") else sys.stdout
+    g15lanes.print_lanes(g, values, out_file)
+    if out_fn != "":
+        out_file.close()
+
+# -----------------------------------------------------------------------------
+# DIAPER regression: every block is loaded into the line named in its header
+# and the emulator sums it the way the DIAPER checksum routines do (AD the
+# word at T into AR, then AD the other 107 words into AR+). The sum is
+# compared with the "Expected checksum" given in the header comments.
+# -----------------------------------------------------------------------------
+def parse_asm_header(asm_file):
+    # Returns [line, expected checksum or None] from the header comments
+    line = None
+    expected = None
+    for text in asm_file:
+        if (not text.startswith("#")):
+            continue
+        m = re.match(r"#\s*Line\s+M?(\d+)", text)
+        if (m and line is None):
+            line = int(m.group(1))
+        m = re.search(r"Expected checksum:\s*(-?\.[0-9u-z]{7})", text)
+        if (m and expected is None):
+            expected = str_to_word29(m.group(1))
+    return [line if (line is not None) else 0, expected]
+
+def asm_files(args):
+    # The .asm files named by args, directories expanded
+    files = []
+    for arg in args:
+        if os.path.isdir(arg):
+            files += sorted([os.path.join(arg, fn) for fn in os.listdir(arg)
+                             if fn.endswith(".asm")])
+        elif os.path.isfile(arg):
+            files.append(arg)
+        else:
+            # Checked here, before any worker process opens it
+            eprint("Error: Input file not found:", arg)
+            sys.exit(1)
+    if files == []:
+        eprint("Error: No .asm files in:", " ".join(args))
+        sys.exit(1)
+    return files
+
+def regress_file(fn, max_wt, resume_fn=""):
+    # Runs in a pool worker. A worker that exits leaves the pool waiting
+    # for its result forever, so a file that cannot be read or assembled
+    # gives an "error" result instead.
+    try:
+        return regress_run(fn, max_wt, resume_fn)
+    except (SystemExit, OSError, ValueError, IndexError) as e:
+        error = "exit status " + str(e.code) if isinstance(e, SystemExit) else str(e)
+        return {"file": fn,
+                "line": None,
+                "expected": None,
+                "checksum": None,
+                "status": "error",
+                "stop": error,
+                "checksum_word_times": 0,
+                "checksum_commands": 0}
+
+def regress_run(fn, max_wt, resume_fn):
+    import g15emu
+    asm_file = open_input_file(fn)
+    [line, expected] = parse_asm_header(asm_file)
+    asm_file.close()
+    block = read_input_blocks(fn)[0]
+    g15 = g15emu.G15()
+    if resume_fn != "":
+        # Every test starts from the same saved machine
+        snap_file = open_input_file(resume_fn, "rb")
+        g15.restore(snap_file)
+        snap_file.close()
+    g15.load(line, block)
+    # The checksum routine runs from the first other command line
+    harness_line = [cl for cl in g15emu.cl_line[:6] if cl != line][0]
+    harness = [[0, ".02.02.1." + bin_to_dstr(line) + ".28"],
+               [2, "u.02.03.1." + bin_to_dstr(line) + ".29"],
+               [3, ".05.05.0.16.31"]]
+    for [addr, asm] in harness:
+        g15.load(harness_line, [str_asm_word29(asm)], addr)
+    g15.cd = g15emu.cl_line.index(harness_line)
+    g15.run(max_wt)
+    if (expected is None):
+        status = "no expected checksum"
+    elif (g15.stop_reason.startswith("HALT") and g15.ar == expected):
+        status = "pass"
+    else:
+        status = "fail"
+    return {"file": fn,
+            "line": line,
+            "expected": word29_to_str(expected).strip() if (expected is not None) else None,
+            "checksum": word29_to_str(g15.ar).strip(),
+            "status": status,
+            "stop": g15.stop_reason,
+            # The cost of the checksum harness, the same for every block of
+            # a line; the block's own code is not run
+            "checksum_word_times": g15.wt,
+            "checksum_commands": g15.commands}
+
+def regress():
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "j:m:o:r:", ["resume="])
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    if len(args) == 0:
+        usage()
+    jobs = os.cpu_count()
+    max_wt = 108 * 1000
+    summary_fn = ""
+    resume_fn = ""
+    try:
+        for o, a in opts:
+            if o == "-j":
+                jobs = int(a)
+            elif o == "-m":
+                max_wt = int(a)
+            elif o == "-o":
+                summary_fn = a
+            elif o in ("-r", "--resume"):
+                resume_fn = a
+    except ValueError:
+        usage()
+    if (jobs < 1):
+        eprint("Error: Invalid number of jobs:", jobs)
+        sys.exit(1)
+    if resume_fn != "":
+        import g15emu
+        snap_file = open_input_file(resume_fn, "rb")
+        try:
+            g15emu.G15().restore(snap_file)
+        except ValueError as e:
+            eprint("Error:", e, resume_fn)
+            sys.exit(1)
+        snap_file.close()
+    files = asm_files(args)
+    with multiprocessing.Pool(min(jobs, len(files))) as pool:
+        results = pool.starmap(regress_file, [(fn, max_wt, resume_fn) for fn in files])
+    summary = {"passed": len([r for r in results if r["status"] == "pass"]),
+               "failed": len([r for r in results if r["status"] == "fail"]),
+               "unchecked": len([r for r in results if r["status"] == "no expected checksum"]),
+               "errors": len([r for r in results if r["status"] == "error"]),
+               "results": results}
+    if summary_fn != "":
+        summary_file = open_output_file(summary_fn)
+        json.dump(summary, summary_file, indent=2)
+        summary_file.close()
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    for r in results:
+        if (r["status"] == "fail"):
+            eprint("FAIL:", r["file"], "expected", r["expected"], "checksum", r["checksum"])
+        elif (r["status"] == "error"):
+            eprint("ERROR:", r["file"], r["stop"])
+    if summary["failed"] != 0 or summary["errors"] != 0:
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------
+# Incremental build: every directory holds a cache, BUILD_CACHE, of the
+# content hash of each .asm file it was last built from. A file is
+# assembled again only when its hash, the assembler (the hash of this
+# file) or the mode changed, or when one of its outputs is missing.
+# -----------------------------------------------------------------------------
+BUILD_CACHE = ".g15build.json"
+
+def file_hash(fn):
+    with open(fn, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def build_file(asm_fn, multi):
+    # Runs in a pool worker and returns an error message, or None. An exit
+    # in a worker would leave the pool waiting for it forever.
+    print("Assembling:", asm_fn)
+    try:
+        assemble_outputs(asm_fn, multi)
+    except SystemExit as e:
+        return "exit status " + str(e.code)
+    except (OSError, ValueError, IndexError) as e:
+        return str(e)
+    return None
+
+def build():
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "j:mf")
+    except getopt.GetoptError as err:
+        eprint(str(err))
+        usage()
+    if len(args) == 0:
+        usage()
+    jobs = os.cpu_count()
+    multi = False
+    force = False
+    try:
+        for o, a in opts:
+            if o == "-j":
+                jobs = int(a)
+            elif o == "-m":
+                multi = True
+            elif o == "-f":
+                force = True
+    except ValueError:
+        usage()
+    if (jobs < 1):
+        eprint("Error: Invalid number of jobs:", jobs)
+        sys.exit(1)
+    tool = file_hash(os.path.abspath(__file__))
+    caches = {}
+    stale = []
+    keys = {}
+    files = asm_files(args)
+    for fn in files:
+        if not fn.endswith(".asm"):
+            eprint("Error: Input filename must have .asm extension:", fn)
+            sys.exit(1)
+        src_dir = os.path.dirname(fn)
+        if src_dir not in caches:
+            try:
+                with open(os.path.join(src_dir, BUILD_CACHE)) as cache_file:
+                    caches[src_dir] = json.load(cache_file)
+            except (OSError, ValueError):
+                caches[src_dir] = {}
+        try:
+            key = {"source": file_hash(fn), "tool": tool, "multi": multi}
+        except OSError:
+            eprint("Error: Input file not found:", fn)
+            sys.exit(1)
+        fname, fext = os.path.splitext(fn)
+        if (force or caches[src_dir].get(os.path.basename(fn)) != key or
+            not os.path.exists(fname + ".lst") or not os.path.exists(fname + ".pti")):
+            stale.append(fn)
+            keys[fn] = key
+    errors = []
+    if stale != []:
+        with multiprocessing.Pool(min(jobs, len(stale))) as pool:
+            errors = pool.starmap(build_file, [(fn, multi) for fn in stale])
+    failed = []
+    for fn, error in zip(stale, errors):
+        if error is None:
+            caches[os.path.dirname(fn)][os.path.basename(fn)] = keys[fn]
+        else:
+            # Not cached, so the file is assembled again next time
+            eprint("Error: Assembling", fn + ":", error)
+            caches[os.path.dirname(fn)].pop(os.path.basename(fn), None)
+            failed.append(fn)
+    for src_dir in caches:
+        try:
+            write_file_atomic(os.path.join(src_dir, BUILD_CACHE),
+                              json.dumps(caches[src_dir], indent=1, sort_keys=True))
+        except OSError:
+            # Without a writable cache everything is rebuilt next time
+            pass
+    print("Assembled:", len(stale) - len(failed), "Up to date:", len(files) - len(stale),
+          "Failed:", len(failed))
+    if failed != []:
+        sys.exit(1)
+
 def balance():
     if (len(sys.argv) != 4):
         usage()
@@ -888,6 +2493,22 @@ def main():
         balance()
     elif cmd == "sum":
         sum()
+    elif cmd == "run":
+        run()
+    elif cmd == "drum":
+        drum()
+    elif cmd == "regress":
+        regress()
+    elif cmd == "build":
+        build()
+    elif cmd == "cost":
+        cost()
+    elif cmd == "trace":
+        trace()
+    elif cmd == "cosim":
+        cosim()
+    elif cmd == "sweep":
+        sweep()
     else:
         usage()
 
@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+
+# Regression tests for g15util.py. Run with "python -m pytest" from this
+# directory. The command line tests run g15util.py in a subprocess with a
+# timeout so that a hung worker pool fails the test instead of the run.
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+import g15util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+G15UTIL = os.path.join(HERE, "g15util.py")
+DIAPER = os.path.join(HERE, "diaper")
+
+def g15util_cmd(*args, timeout=60):
+    return subprocess.run([sys.executable, G15UTIL] + list(args), cwd=HERE,
+                          capture_output=True, text=True, timeout=timeout)
+
+# -----------------------------------------------------------------------------
+# regress
+# -----------------------------------------------------------------------------
+def test_regress_missing_file(tmp_path):
+    missing = str(tmp_path / "nosuch.asm")
+    r = g15util_cmd("regress", "-j", "2", os.path.join(DIAPER, "testv_0.asm"), missing)
+    assert r.returncode == 1
+    assert "Input file not found" in r.stderr
+
+def test_regress_result_fields():
+    # The word times and commands are those of the checksum harness
+    r = g15util.regress_file(os.path.join(DIAPER, "test8_1.asm"), 108 * 1000)
+    assert [r["status"], r["checksum"]] == ["pass", "-.7xw7v2x"]
+    assert [r["checksum_word_times"], r["checksum_commands"]] == [221, 3]
+    assert "word_times" not in r and "commands" not in r
+
+def test_regress_file_error_result(tmp_path):
+    # A file that disappears after the parent checked it gives an error
+    # result in the worker rather than an exit
+    r = g15util.regress_file(str(tmp_path / "gone.asm"), 108 * 1000)
+    assert r["status"] == "error"
+
+# -----------------------------------------------------------------------------
+# build
+# -----------------------------------------------------------------------------
+def test_build_missing_file(tmp_path):
+    r = g15util_cmd("build", "-j", "2", str(tmp_path / "nosuch.asm"))
+    assert r.returncode == 1
+    assert "Input file not found" in r.stderr
+
+def test_build_worker_error(tmp_path):
+    # The listing cannot replace a directory: the worker reports the error
+    # and the file stays out of the build cache
+    with open(os.path.join(DIAPER, "testv_0.asm")) as f:
+        source = f.read()
+    (tmp_path / "good.asm").write_text(source)
+    (tmp_path / "bad.asm").write_text(source)
+    (tmp_path / "bad.lst").mkdir()
+    r = g15util_cmd("build", "-j", "2", str(tmp_path))
+    assert r.returncode == 1
+    assert "Failed: 1" in r.stdout
+    cache = (tmp_path / g15util.BUILD_CACHE).read_text()
+    assert "good.asm" in cache and "bad.asm" not in cache
+
+def test_build_file_missing(tmp_path):
+    assert g15util.build_file(str(tmp_path / "gone.asm"), False) is not None
+
+# -----------------------------------------------------------------------------
+# Block index (dis <file> <block>)
+# -----------------------------------------------------------------------------
+JSON_TAPE = """{
+ "entries": [
+  {"blocknum": 0, "nerrors": 0, "checksum": "x", "data": " 00000000000000000000000000001S"},
+  {"blocknum": 1, "nerrors": 0, "checksum": "x", "data": " 00000000000000000000000000002S"}
+ ]
+}
+"""
+
+def test_dis_block_invalid_json(tmp_path):
+    bad = tmp_path / "bad.json"
+    bad.write_text('{"entries": [ {"blocknum": 0, "nerr')
+    r = g15util_cmd("dis", str(bad), "0")
+    assert r.returncode == 1
+    assert "Invalid JSON file format" in r.stderr
+    assert "Traceback" not in r.stderr
+
+def test_dis_block_not_a_tape(tmp_path):
+    asm = tmp_path / "x.asm"
+    asm.write_text("00:  .05.05.0.16.31\n")
+    r = g15util_cmd("dis", str(asm), "0")
+    assert r.returncode == 1
+    assert "Traceback" not in r.stderr
+
+def test_corrupt_index_rebuilt(tmp_path):
+    tape = tmp_path / "t.json"
+    tape.write_text(JSON_TAPE)
+    assert list(g15util.read_tape_block(str(tape), 1)) == [2, 0, 0, 0]
+    idx_fn = str(tape) + ".idx"
+    # Garbage in the sidecar is a cache miss
+    with open(idx_fn, "w") as f:
+        f.write("{not json")
+    assert list(g15util.read_tape_block(str(tape), 1)) == [2, 0, 0, 0]
+    # So are spans that match the tape's size and time but not its entries
+    with open(idx_fn) as f:
+        idx = g15util.json.load(f)
+    idx["spans"] = [[0, 1], [1, 2]]
+    with open(idx_fn, "w") as f:
+        g15util.json.dump(idx, f)
+    assert list(g15util.read_tape_block(str(tape), 1)) == [2, 0, 0, 0]
+
+# -----------------------------------------------------------------------------
+# Block
+# -----------------------------------------------------------------------------
+def test_block_buffer():
+    block = g15util.Block([1, 2, 3])
+    view = memoryview(block.buffer())
+    assert view.format == "I" and view.tolist() == [1, 2, 3]
+    if g15util.np is not None:
+        assert g15util.blocks_to_array([block])[0, :3].tolist() == [1, 2, 3]
+
+def test_block_as_list():
+    # Indexes and slices behave as for the list a Block replaced
+    block = g15util.Block([1, 2, 3, 4])
+    block[-1] = 9
+    assert list(block) == [1, 2, 3, 9] and block.is_valid(3)
+    assert block[0:3] == [1, 2, 3] and block[0:3] + [5] == [1, 2, 3, 5]
+    assert block[::2] == [1, 3]
+    block[0:2] = [7, 8]
+    assert list(block) == [7, 8, 3, 9]
+    block[-2:] = (5, 6)
+    assert list(block) == [7, 8, 5, 6]
+    with pytest.raises(ValueError):
+        block[0:2] = [1]
+    with pytest.raises(IndexError):
+        block[4] = 1
+    with pytest.raises(IndexError):
+        block[-5] = 1
+    unused = g15util.Block.unused(4)
+    unused[1:3] = [1, 2]
+    assert [unused.is_valid(a) for a in range(4)] == [False, True, True, False]
+
+def test_empty_block_sentinel(tmp_path):
+    # Every block reader returns an empty Block when there is no block
+    assert len(g15util.read_pti_block(g15util.io.StringIO(""))) == 0
+    assert len(g15util.quads_to_block("")) == 0
+    tape = tmp_path / "t.json"
+    tape.write_text(JSON_TAPE)
+    assert len(g15util.read_tape_block(str(tape), 5)) == 0
+    pti = tmp_path / "t.pti"
+    with open(pti, "w") as f:
+        g15util.print_pti_block(g15util.Block([7]), f)
+    assert list(g15util.read_tape_block(str(pti), 0)) == [7, 0, 0, 0]
+    assert len(g15util.read_tape_block(str(pti), 1)) == 0
+
+# -----------------------------------------------------------------------------
+# Multi-line assembler
+# -----------------------------------------------------------------------------
+def assemble(source):
+    return g15util.assemble_multi_file(g15util.io.StringIO(source))
+
+def test_asm_multi_placement():
+    # Each floating statement goes where its predecessor's N of * finds it
+    # soonest, and T of * in an immediate command is L+2
+    [blocks, symbols] = assemble("""
+        data = 01:50
+        start: 01:00: u.*.*.0.02.03
+        next:  01:*:   .data.*.0.01.28
+               01:*:   .05.05.0.16.31
+               01:50:  .0000007
+        """)
+    [[line, block]] = blocks
+    assert line == 1 and symbols["next"] == ['A', 1, 2]
+    assert block.order == [0, 2, 51, 50]
+    words = g15util.str_asm_word29
+    assert [block[0], block[2], block[51]] == \
+           [words("u.02.02.0.02.03"), words(".50.51.0.01.28"), words(".05.05.0.16.31")]
+    # The chain runs to the halt
+    import g15emu
+    g15 = g15emu.G15()
+    g15.load(1, block)
+    g15.cd = g15emu.cl_line.index(1)
+    assert g15.run(1000) == "HALT at 01[51]"
+    assert g15.ar == 14
+
+def test_asm_multi_errors(capsys):
+    # T of * in a deferred transfer is an error, and the floating statement
+    # after it is not placed
+    [blocks, symbols] = assemble("""
+        01:00: .*.*.0.02.03
+        after: 01:*: .05.05.0.16.31
+        """)
+    err = capsys.readouterr().err
+    assert "T of * in a deferred command" in err and "Not placed" in err
+    assert blocks == [] and symbols["after"][2] is None
+    # A floating label used in T before it is placed stops the chain too
+    [blocks, symbols] = assemble("""
+        01:00: u.later.*.0.02.03
+        01:*:  .05.05.0.16.31
+        later: 01:*: .05.05.0.16.31
+        """)
+    assert "Not placed" in capsys.readouterr().err
+    assert [block.order for [line, block] in blocks] == [[1]]
+
+# -----------------------------------------------------------------------------
+# Command timing (listings and placement)
+# -----------------------------------------------------------------------------
+def timing(asm, waddr):
+    word = g15util.str_asm_word29(asm)
+    return [g15util.command_timing(word, waddr), g15util.command_to_semantics(word, waddr)]
+
+def test_command_timing_t_past_107():
+    # T counts modulo the 108 words of a revolution
+    [t, text] = timing(".v0.01.0.02.03", 5)
+    assert t == [False, 2, 2]
+    assert text.startswith("D    [02]")
+
+def test_command_timing_double_precision():
+    # A deferred double-precision command transfers the pair T, T+1 when T
+    # is even and only T when it is odd, as g15emu does
+    assert timing(".10.01.4.02.03", 5)[0] == [False, 10, 11]
+    assert timing(".11.01.4.02.03", 5)[0] == [False, 11, 11]
+    assert timing(".v0.01.4.02.03", 5)[0] == [False, 2, 3]
+    assert timing(".v1.01.4.02.03", 5)[0] == [False, 3, 3]
+    assert timing(".10.01.4.02.03", 5)[1].startswith("D [10:11]")
+    # Single precision is one word whatever the parity
+    assert timing(".10.01.0.02.03", 5)[0] == [False, 10, 10]
+
+def test_command_timing_immediate():
+    assert timing("u.10.01.0.02.03", 5)[0] == [True, 6, 9]
+    assert timing("u.v0.01.0.02.03", 5)[0] == [True, 6, 1]
+
+def test_command_timing_deferred_special():
+    # The S/D bit of a special is part of C: Test_Sign from line 4 (C = 4)
+    # at T = 10 runs one word time
+    assert timing("w.10.20.4.22.31", 5)[0] == [False, 10, 10]
+    assert timing("w.10.20.0.22.31", 5)[0] == [False, 10, 10]
+
+def test_command_cost_matches_emulator():
+    # RC, the wait for the first word, the run and the wait for N add up to
+    # the word times from reading the command to reading the next one
+    for asm in [".10.20.0.01.02", ".10.20.4.01.02", ".11.20.4.01.02", ".06.20.0.01.02",
+                "u.10.20.0.01.02", "w.10.20.4.22.31", "w.10.20.0.22.31"]:
+        [wait, run, next_wait] = g15util.command_cost(g15util.str_asm_word29(asm), 5)
+        g15 = step_command(asm)
+        assert 1 + wait + run + next_wait == g15.wt - 5 + (g15.n - g15.wt) % 108, asm
+    # The special runs one word time and waits one more for N
+    assert g15util.command_cost(g15util.str_asm_word29("w.10.20.4.22.31"), 5) == [4, 1, 9]
+
+def test_cost_paths():
+    block = g15util.Block.unused()
+    # 00 -> 10 -> 30 (TEST, N+1 = 41) -> 40 halts; 41 -> 10 joins the path
+    for [addr, asm] in [[0, "u.02.10.0.01.02"], [10, ".20.30.0.01.02"],
+                        [30, ".32.40.0.01.27"], [41, ".45.10.0.01.02"],
+                        [40, ".42.40.0.16.31"]]:
+        block.set_word(addr, g15util.str_asm_word29(asm), 'A')
+    paths = g15util.cost_paths(block, [0])
+    assert [[p[0], p[2]] for p in paths] == [[[0, 10, 30, 40], "exit"], [[41], "joins 10"]]
+    costs = [sum(g15util.command_cost(block[a], a)) + 1 for a in [0, 10, 30, 40]]
+    assert paths[0][1] == sum(costs)
+    # T = L+1 on a deferred command waits a revolution and is flagged
+    block.set_word(50, g15util.str_asm_word29(".51.52.0.01.02"), 'A')
+    assert g15util.command_cost(block[50], 50)[0] >= g15util.COST_LOSS
+    report = g15util.io.StringIO()
+    g15util.print_cost_report(block, [0], report)
+    assert "lost revolutions: 1" in report.getvalue()
+
+# -----------------------------------------------------------------------------
+# Profile
+# -----------------------------------------------------------------------------
+def test_profile_counts_skipped_ready_loop(tmp_path):
+    # Read tape blocks, spinning on Ready_Test until each one is in. The
+    # revolutions skip_ready_loop jumps over are counted in the profile.
+    asm = tmp_path / "rd.asm"
+    asm.write_text("00:  .01.01.0.15.31\n"
+                   "01:  .02.01.0.28.31\n"
+                   "02: u.04.00.0.19.18\n")
+    tape = tmp_path / "t.pti"
+    with open(tape, "w") as f:
+        for i in range(20):
+            g15util.print_pti_block(g15util.Block([i] * 108), f)
+    r = g15util_cmd("run", "-p", "-m", str(108 * 20000), "-t", str(tape), str(asm))
+    assert r.returncode == 0
+    with open(tmp_path / "rd.prof.json") as f:
+        prof = g15util.json.load(f)
+    addresses = prof["addresses"]
+    assert sum(a["count"] for a in addresses) == prof["commands"]
+    assert sum(a["word_times"] + a["wait"] for a in addresses) == prof["word_times"]
+    assert addresses[1]["count"] == prof["specials"]["28"]
+
+# -----------------------------------------------------------------------------
+# .g15b
+# -----------------------------------------------------------------------------
+def test_g15b_checksum_mismatch(tmp_path):
+    fn = str(tmp_path / "t.g15b")
+    with open(fn, "wb") as f:
+        g15util.write_g15b_file([g15util.Block([1, 2]), g15util.Block([3])], f, {})
+    assert list(g15util.read_tape_block(fn, 1)) == [3]
+    # Corrupt the first word of block 1
+    with open(fn, "r+b") as f:
+        header = g15util.G15B_HEADER.unpack(f.read(g15util.G15B_HEADER.size))
+        f.seek(header[7] + 4 * 108)
+        f.write(g15util.struct.pack("<I", 5))
+    r = g15util_cmd("dis", fn)
+    assert r.returncode == 1
+    assert "Checksum mismatch in .g15b file" in r.stderr and "block 1" in r.stderr
+    r = g15util_cmd("dis", fn, "1")
+    assert r.returncode == 1
+    assert "Checksum mismatch" in r.stderr
+    r = g15util_cmd("dis", fn, "0")
+    assert r.returncode == 0
+
+# -----------------------------------------------------------------------------
+# Output
+# -----------------------------------------------------------------------------
+def test_output_default_is_current_stdout(monkeypatch):
+    # sys.stdout is replaced after g15emu was imported
+    import g15emu
+    out = g15util.io.StringIO()
+    monkeypatch.setattr(sys, "stdout", out)
+    g15emu.print_state(g15emu.G15())
+    sink = g15emu.OutputSink()
+    sink.write("type", 0, "HELLO", g15emu.TYPE_CPS)
+    sink.flush()
+    assert "Stopped:" in out.getvalue() and "HELLO" in out.getvalue()
+
+# -----------------------------------------------------------------------------
+# Snapshots
+# -----------------------------------------------------------------------------
+def test_snapshot_reader_position(tmp_path):
+    import g15emu
+    g15 = g15emu.G15()
+    g15.mount_tape(g15emu.PhotoReader(b"0123456789"))
+    g15.reader.pos = 7
+    g15.reader.chars = 5000000000
+    snap_fn = tmp_path / "s.g15s"
+    with open(snap_fn, "wb") as f:
+        g15.save(f)
+    g15 = g15emu.G15()
+    with open(snap_fn, "rb") as f:
+        g15.restore(f)
+    assert [g15.reader.pos, g15.reader.chars] == [7, 5000000000]
+
+# -----------------------------------------------------------------------------
+# VCD traces
+# -----------------------------------------------------------------------------
+def test_vcd_word_addresses():
+    import g15trace
+    # Three words of S; T0 is set in the last bit time of the second
+    lines = ["$var wire 1 c CLOCK $end", "$var wire 1 t T29 $end",
+             "$var wire 1 z T0 $end", "$var wire 1 s S $end",
+             "$enddefinitions $end"]
+    words = [5, 6, 7]
+    for j in range(29 * len(words)):
+        [w, b] = divmod(j, 29)
+        lines += ["#" + str(2 * j), "0c", str(int(b == 28)) + "t",
+                  str(int(j == 29 + 28)) + "z", str((words[w] >> b) & 1) + "s",
+                  "#" + str(2 * j + 1), "1c"]
+    lines.append("#" + str(2 * 29 * len(words)))
+    vcd_file = g15util.io.StringIO("\n".join(lines) + "\n")
+    records = list(g15trace.iter_vcd_words(vcd_file, "CLOCK", "T29", "T0", ["S"]))
+    assert records == [[0, None, [5]], [1, 107, [6]], [2, 0, [7]]]
+
+def test_cosim_load_short_lines(tmp_path):
+    # Blocks may be loaded into any line 0-23 before the log is compared
+    log = tmp_path / "empty.log"
+    log.write_text("")
+    asm = os.path.join(DIAPER, "testv_0.asm")
+    r = g15util_cmd("cosim", "-l", "20:" + asm, "-l", "23:" + asm, str(log))
+    assert r.returncode == 0
+    assert "No differences" in r.stdout
+
+# -----------------------------------------------------------------------------
+# JSON tape entries
+# -----------------------------------------------------------------------------
+def test_json_entries_top_level_only(monkeypatch):
+    # "entries" nested deeper, inside a string or as a value is not the
+    # array, at any chunk size
+    text = ('{"header": {"entries": [{"x": 1}]}, "note": "say \\"entries\\": [2]\\\\",'
+            ' "name": "entries", "entries" : [{"blocknum": 7}, {"blocknum": 8}]}')
+    for size in (1, 2, 3, 5, 8, 1 << 16):
+        monkeypatch.setattr(g15util, "PT_CHUNK_SIZE", size)
+        entries = list(g15util.iter_json_entries(g15util.io.StringIO(text)))
+        assert [e[0] for e in entries] == [{"blocknum": 7}, {"blocknum": 8}]
+        [start, end] = entries[0][1:]
+        assert text[start:end] == '{"blocknum": 7}'
+
+def test_json_entries_missing(monkeypatch):
+    monkeypatch.setattr(g15util, "PT_CHUNK_SIZE", 4)
+    for text in ('{"header": {"entries": []}}', '{"entries": null}', '{"entries"'):
+        with pytest.raises(ValueError):
+            list(g15util.iter_json_entries(g15util.io.StringIO(text)))
+
+# -----------------------------------------------------------------------------
+# Emulator
+# -----------------------------------------------------------------------------
+HALT = ".05.05.0.16.31"
+
+def test_load_short_line():
+    # The 4 words of line 23 repeat every fourth word address, and a load
+    # replaces the translation of every address a word is read from
+    import g15emu
+    g15 = g15emu.G15()
+    g15.load(23, [g15util.str_asm_word29(HALT)])
+    g15.cd = g15emu.cl_line.index(23)
+    assert g15.run(1000).startswith("HALT")
+    assert g15.m[23][0] == g15util.str_asm_word29(HALT)
+    g15.load(23, [g15util.str_asm_word29(".01.01.0.28.28")], 104)
+    g15.halted = False
+    g15.n = 0
+    assert g15.run(1000) == "word time limit"
+    r = g15util_cmd("run", "-l", "23", "-e", "23:00", "-m", "10000",
+                    os.path.join(DIAPER, "testv_0.asm"))
+    assert r.returncode == 0 and "Traceback" not in r.stderr
+
+def num(v):
+    # Sign and magnitude word of v, as numbers are kept on the drum
+    return ((-v) << 1 | 1) if (v < 0) else (v << 1)
+
+def ar_num(v):
+    # AR keeps a negative number as the complement of its magnitude
+    return ((((1 << 28) + v) << 1) | 1) if (v < 0) else (v << 1)
+
+def step_command(asm, words={}, ar=0, pn=0, l=5):
+    # Execute the one command asm read from line 0 at word address l, with
+    # the drum words given by {(line, word address): word}
+    import g15emu
+    g15 = g15emu.G15()
+    for [[line, a], word] in words.items():
+        g15.m[line][a] = word
+    g15.ar = ar
+    g15.set58(26, abs(pn))
+    g15.m[26][0] |= 1 if (pn < 0) else 0
+    g15.load(0, [g15util.str_asm_word29(asm)], l)
+    g15.n = l
+    g15.step()
+    return g15
+
+def test_deferred_timing():
+    # RC at L = 5 takes word time 5; a deferred transfer starts at T
+    assert step_command(".07.20.0.01.02").wt == 8
+    # T = L+1 passes under the heads during RC: a full revolution later
+    g15 = step_command(".06.20.0.01.02", {(1, 6): 9})
+    assert g15.wt == 5 + 1 + 108 + 1 and g15.m[2][6] == 9
+    # Double precision from an even T moves T and T+1, from an odd T only T
+    g15 = step_command(".10.20.4.01.02", {(1, 10): 3, (1, 11): 4})
+    assert g15.wt == 12 and [g15.m[2][10], g15.m[2][11]] == [3, 4]
+    g15 = step_command(".11.20.4.01.02", {(1, 11): 4, (1, 12): 5})
+    assert g15.wt == 12 and [g15.m[2][11], g15.m[2][12]] == [4, 0]
+    assert g15.n == 20
+
+def test_add_to_ar():
+    # [characteristic, AR, operand, AR after]: AD, AV and SU into AR+, and
+    # TR into AR+, which adds the word as it is
+    cases = [[1, 5, 3, 8], [1, 5, -3, 2], [1, -5, -3, -8], [1, -5, 3, -2],
+             [2, 5, -3, 8], [2, -5, 3, -2],
+             [3, 5, 3, 2], [3, 5, -3, 8], [3, -5, -3, -2],
+             [0, 5, 3, 8]]
+    for [ch, ar, v, result] in cases:
+        g15 = step_command(".10.20." + str(ch) + ".01.29", {(1, 10): num(v)}, ar_num(ar))
+        assert [g15.ar, g15.fo] == [ar_num(result), 0], [ch, ar, v]
+    # Overflow when like signs give a sum of the other sign
+    big = (1 << 28) - 1
+    assert step_command(".10.20.1.01.29", {(1, 10): num(2)}, ar_num(big)).fo == 1
+    assert step_command(".10.20.1.01.29", {(1, 10): num(-2)}, ar_num(-big)).fo == 1
+    assert step_command(".10.20.3.01.29", {(1, 10): num(2)}, ar_num(-big)).fo == 1
+    assert step_command(".10.20.1.01.29", {(1, 10): num(-2)}, ar_num(big)).fo == 0
+
+def test_add_to_pn():
+    # Double-precision AD and SU into PN+: the odd word continues the
+    # complement of a negative even word
+    for [ch, v, result] in [[5, 3, 8], [5, -3, 2], [5, -7, -2], [7, 3, 2], [7, -3, 8]]:
+        g15 = step_command(".10.20." + str(ch) + ".01.30", {(1, 10): num(v), (1, 11): 0}, pn=5)
+        pn = g15.get58(26)
+        if (g15.m[26][0] & 0x1):
+            pn -= 1 << 57
+        assert [pn, g15.fo] == [result, 0], [ch, v]
+    g15 = step_command(".10.20.5.01.30", {(1, 10): num(1), (1, 11): 0}, pn=(1 << 57) - 1)
+    assert g15.fo == 1
+
+def test_mark_and_return_exit():
+    import g15emu
+    g15 = g15emu.G15()
+    # 00[00] marks word time 1 and continues at 01[05]; the return there
+    # comes back to 00[01] a revolution after the mark
+    g15.load(0, [g15util.str_asm_word29(".01.05.1.21.31"), g15util.str_asm_word29(HALT)])
+    g15.load(1, [g15util.str_asm_word29(".06.07.0.20.31")], 5)
+    assert g15.run(1000) == "HALT at 00[01]"
+    assert [g15.mark, g15.wt, g15.commands] == [1, 113, 3]
+    assert [g15.specials[20], g15.specials[21]] == [1, 1]
+
+def test_diaper_checksum_to_halt():
+    # The checksum of line 1 that regress runs, by hand: DIAPER test 8
+    # block 1 sums to its published checksum and halts after 221 word times
+    import g15emu
+    g15 = g15emu.G15()
+    g15.load(1, g15util.read_input_blocks(os.path.join(DIAPER, "test8_1.asm"))[0])
+    for [addr, asm] in [[0, ".02.02.1.01.28"], [2, "u.02.03.1.01.29"], [3, HALT]]:
+        g15.load(0, [g15util.str_asm_word29(asm)], addr)
+    assert g15.run(108 * 100) == "HALT at 00[03]"
+    assert g15util.word29_to_str(g15.ar).strip() == "-.7xw7v2x"
+    assert [g15.wt, g15.commands] == [221, 3]
+
+def test_multiply_divide_closed_forms():
+    # special_shift computes multiply and divide at once where it can; the
+    # result must be that of the steps taken one at a time
+    import random
+    import g15emu
+    rng = random.Random(15)
+    g15 = g15emu.G15()
+    for i in range(2000):
+        steps = [0, 1, 27, 53, 54][i % 5]
+        count = 2 * steps + rng.randrange(2)
+        mq = rng.getrandbits(57)
+        # IDs with low zero bits take the multiply closed form
+        id = rng.getrandbits(57) >> rng.randrange(58) << rng.randrange(58) & g15emu.MASK57
+        pn = rng.getrandbits(57) if (i % 3 == 0) else rng.randrange(2 * id + 1) & g15emu.MASK57
+        for [s, ch] in [[24, 0], [25, 1]]:
+            g15.set58(24, mq)
+            g15.set58(25, id)
+            g15.set58(26, pn)
+            g15.fo = 0
+            assert g15.special_shift(s, ch, count) == count
+            if (s == 24):
+                expected = g15emu.multiply_steps(mq, id, pn, steps)
+                fo = 0
+            else:
+                [q, r] = g15emu.divide_steps(mq, id, pn, steps)
+                expected = [q, id, r & g15emu.MASK57]
+                fo = 1 if (r > g15emu.MASK57) else 0
+            assert [g15.get58(24), g15.get58(25), g15.get58(26), g15.fo] == expected + [fo], [s, mq, id, pn, steps]
+
+# -----------------------------------------------------------------------------
+# Lane emulator
+# -----------------------------------------------------------------------------
+def test_lanes_match_g15():
+    # Each lane runs as a G15 of its own would, here a DIAPER block started
+    # with 16 random AR values
+    import random
+    import g15emu
+    import g15lanes
+    np = pytest.importorskip("numpy")
+    rng = random.Random(23)
+    block = g15util.read_input_blocks(os.path.join(DIAPER, "test8_2.asm"))[0]
+    values = [rng.getrandbits(29) for k in range(16)]
+    lanes = g15lanes.G15Lanes(len(values))
+    lanes.load(0, block)
+    lanes.ar[:] = values
+    lanes.run(108 * 500)
+    for k in range(len(values)):
+        g15 = g15emu.G15()
+        g15.load(0, block)
+        g15.ar = values[k]
+        g15.run(108 * 500)
+        assert [lanes.stop_reason(k), int(lanes.wt[k]), int(lanes.commands[k])] == \
+               [g15.stop_reason, g15.wt, g15.commands]
+        assert [int(lanes.ar[k]), int(lanes.fo[k]), int(lanes.ip[k])] == [g15.ar, g15.fo, g15.ip]
+        words = np.concatenate([np.array(line, dtype=np.uint32) for line in g15.m])
+        assert (lanes.mem[:, k] == words).all()
+    assert len(set(lanes.ar.tolist())) > 1